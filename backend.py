@@ -5,6 +5,11 @@ import urllib.request
 import sys
 import json
 import datetime
+import threading
+import queue
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
 import pyttsx3
 
 # Base paths
@@ -38,8 +43,23 @@ def load_config():
     default = {
         "dataset_dir": DATASET_DIR,
         "camera_index": 0,
+        "video_source": "", # video file or image folder to replay instead of the camera
         "recognition_threshold": 0.6,
         "samples_per_student": 50,
+        "use_pca": False,
+        "pca_components": 200,
+        "search_mode": "full", # "full" or "coarse" (thumbnail shortlist, then full-resolution re-rank)
+        "coarse_candidates": 200,
+        "coarse_tolerance": 0.02, # max share of faces where coarse search may disagree with the full KNN
+        "prototypes_per_student": 0, # 0 keeps every recorded sample, otherwise k-means prototypes per student
+        "detection_scale": 1.0,
+        "min_face_size": 0,
+        "max_face_size": 0,
+        "detect_every_n_frames": 3,
+        "recognize_every_n_detections": 10,
+        "auto_mark": False,
+        "auto_mark_stable_frames": 3,
+        "max_match_distance": 0,
     }
     
     if os.path.exists(CONFIG_PATH):
@@ -57,90 +77,973 @@ def save_config(config):
         json.dump(config, f, indent=4)
 
 
-try:
-    tts_engine = pyttsx3.init()
-    tts_engine.setProperty('rate', 150) # Speed of speech
-    tts_engine.setProperty('volume', 1) # Volume (0.0 to 1.0)
-    tts_enabled = True
-except:
-    tts_enabled = False
+class PerfStats:
+    # Rolling per-stage latencies (ms) and frame rates; cheap enough to leave on in production
+    def __init__(self, window=300):
+        self.window = window
+        self._samples = {}
+        self._ticks = {}
+        self._lock = threading.Lock()
 
+    def record(self, stage, ms):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.window)
+            self._samples[stage].append(ms)
 
-def speak(text):
-    if tts_enabled:
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
         try:
-            tts_engine.say(text)
-            tts_engine.runAndWait()
-        except:
-            pass
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def tick(self, counter):
+        # One tick per processed frame; FPS comes from the span of the recent ticks
+        with self._lock:
+            if counter not in self._ticks:
+                self._ticks[counter] = deque(maxlen=self.window)
+            self._ticks[counter].append(time.perf_counter())
+
+    def fps(self, counter):
+        with self._lock:
+            ticks = list(self._ticks.get(counter, ()))
+        if len(ticks) < 2 or ticks[-1] == ticks[0]:
+            return 0.0
+        return (len(ticks) - 1) / (ticks[-1] - ticks[0])
+
+    def summary(self):
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+            counters = list(self._ticks)
+        stages = {}
+        for stage, values in sorted(samples.items()):
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {"p50": float(p50), "p95": float(p95), "p99": float(p99), "count": len(values)}
+        return {"stages": stages, "fps": {counter: self.fps(counter) for counter in counters}}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._ticks.clear()
+
+    def export(self, filename):
+        # JSON with the percentiles plus the raw rolling samples, for offline analysis
+        with self._lock:
+            raw = {stage: list(values) for stage, values in self._samples.items()}
+        data = self.summary()
+        data["exported_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+        data["samples_ms"] = raw
+        try:
+            with open(filename, "w") as f:
+                json.dump(data, f, indent=4)
+            return True
+        except Exception as e:
+            print(f"Export error: {str(e)}")
+            return False
+
+
+perf = PerfStats()
+
+
+class SpeechWorker:
+    # Announcements play on their own thread, so speak() never blocks the camera loop on runAndWait()
+    def __init__(self, maxsize=4, repeat_window=5.0):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.repeat_window = repeat_window # seconds before the same message may be spoken again
+        self.dropped = 0
+        self._pending = set()
+        self._last_spoken = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def say(self, text, key=None):
+        key = key or text
+        now = time.monotonic()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="speech", daemon=True)
+                self._thread.start()
+            
+            # Coalesce: the same message already waiting, or spoken a moment ago, is dropped
+            if key in self._pending or now - self._last_spoken.get(key, -self.repeat_window) < self.repeat_window:
+                self.dropped += 1
+                return False
+            
+            if self.queue.full():
+                try:
+                    old_key, _ = self.queue.get_nowait() # stale announcements make way for new ones
+                    self._pending.discard(old_key)
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+            self.queue.put_nowait((key, text))
+            self._pending.add(key)
+            return True
+
+    def _run(self):
+        global tts_enabled
+        # pyttsx3 drivers should be used from the thread that created them
+        try:
+            engine = pyttsx3.init()
+            engine.setProperty('rate', 150) # Speed of speech
+            engine.setProperty('volume', 1) # Volume (0.0 to 1.0)
+        except Exception:
+            tts_enabled = False
+            return
+        
+        while True:
+            key, text = self.queue.get()
+            with self._lock:
+                self._pending.discard(key)
+                self._last_spoken[key] = time.monotonic()
+            try:
+                engine.say(text)
+                engine.runAndWait()
+            except Exception:
+                pass
+
+
+tts_enabled = True
+speech = SpeechWorker()
+
+
+def speak(text, key=None):
+    # Returns immediately; pass the same key for messages that should not pile up (e.g. "already marked")
+    if tts_enabled:
+        with perf.time("speak"):
+            speech.say(text, key)
 
 
 def distance(v1, v2): #v1 = test (test sample feature) v2 = ix (current training sample feature).
     return np.sqrt(((v1 - v2) ** 2).sum()) #npsqrt makes ([1,4,9,16]) to ([1,2,3,4])
 
 
-def knn(train, test, k=5):
-    dist = []
+class FaceGallery:
+    # Enrolled faces: uint8 pixel rows, a separate int32 label per row and a parallel name table
+    def __init__(self, features, labels, names, offsets=None, source=None, rows=None):
+        self.features = features
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.names = list(names)
+        self.offsets = list(offsets) if offsets is not None else None
+        self.source = source # full gallery this one was sliced from (None for the full gallery)
+        self.rows = rows # row indices into source
+
+    def subset(self, labels):
+        # Only the given students; each student is one contiguous block of rows, so this is a few slices
+        labels = sorted(set(int(label) for label in labels))
+        ends = self.offsets[1:] + [len(self)]
+        blocks = [np.arange(self.offsets[label], ends[label]) for label in labels]
+        rows = np.concatenate(blocks) if blocks else np.empty(0, dtype=np.int64)
+        
+        new_labels = np.concatenate([np.full(len(b), i, dtype=np.int32) for i, b in enumerate(blocks)]) if blocks else rows.astype(np.int32)
+        offsets = list(np.cumsum([0] + [len(b) for b in blocks[:-1]])) if blocks else []
+        source = self.source if self.source is not None else self
+        source_rows = self.rows[rows] if self.rows is not None else rows
+        return FaceGallery(
+            self.features[rows], new_labels, [self.names[label] for label in labels],
+            [int(o) for o in offsets], source, source_rows,
+        )
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    @property
+    def student_count(self):
+        return len(self.names)
+
+    def name_of(self, label):
+        return self.names[int(label)]
+
+    def student_id_of(self, label):
+        # Face files are named after the student id; legacy name-keyed files have no id
+        key = self.names[int(label)]
+        return int(key) if key.isdigit() else None
+
+    def memory_report(self):
+        rows, dim = self.features.shape
+        feature_bytes = rows * dim * self.features.dtype.itemsize
+        label_bytes = self.labels.nbytes
+        students = max(self.student_count, 1)
+        return {
+            "students": self.student_count,
+            "samples": rows,
+            "dim": dim,
+            "feature_bytes": feature_bytes,
+            "label_bytes": label_bytes,
+            "bytes_per_student": (feature_bytes + label_bytes) // students,
+            "legacy_bytes_per_student": (rows * (dim + 1) * 8) // students, # float64 trainset with label column
+        }
+
+
+class KNNMatcher:
+    # Scores query faces against the whole gallery with matrix products instead of a per-row loop.
+    # ||q - g||^2 = ||q||^2 - 2 q.g + ||g||^2, with the gallery norms computed once up front.
+    # features stay in their stored dtype (the uint8 memmap for the full gallery); only chunk_rows rows
+    # are converted to float32 at a time, so RAM does not grow with the roster.
+    def __init__(self, features, labels, k=5, projector=None, chunk_rows=256):
+        self.features = features
+        self.labels = np.asarray(labels).astype(np.int32)
+        self.chunk_rows = chunk_rows
+        self.sq_norms = np.empty(features.shape[0], dtype=np.float32)
+        for start, chunk in self._chunks():
+            self.sq_norms[start:start + chunk.shape[0]] = np.einsum("ij,ij->i", chunk, chunk)
+        self.k = k
+        self.projector = projector # when set, features are already projected and queries get projected too
+
+    @classmethod
+    def from_gallery(cls, gallery, k=5):
+        return cls(gallery.features, gallery.labels, k)
+
+    def _chunks(self):
+        for start in range(0, self.features.shape[0], self.chunk_rows):
+            yield start, np.asarray(self.features[start:start + self.chunk_rows], dtype=np.float32)
+
+    def squared_distances(self, queries, exclude=None):
+        queries = np.atleast_2d(queries)
+        if self.projector is not None:
+            queries = self.projector.transform(queries)
+        queries = np.asarray(queries, dtype=np.float32)
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        d2 = np.empty((queries.shape[0], self.features.shape[0]), dtype=np.float32)
+        for start, chunk in self._chunks():
+            d2[:, start:start + chunk.shape[0]] = queries @ chunk.T
+        d2 = q_norms[:, None] - 2.0 * d2 + self.sq_norms[None, :]
+        if exclude is not None:
+            d2[np.arange(d2.shape[0]), exclude] = np.inf # leave-one-out: hide each query's own gallery row
+        return np.maximum(d2, 0.0) # clip tiny negatives caused by float rounding
+
+    def predict(self, queries, exclude=None):
+        # Returns (labels, votes, nearest_distances) with one entry per query row
+        return vote_top_k(self.squared_distances(queries, exclude), self.labels, self.k)
+
+
+def vote_top_k(d2, labels, k=5):
+    # d2 is (queries, candidates) squared distances, labels the label of each candidate column
+    k = min(k, d2.shape[1])
+    
+    if k < d2.shape[1]:
+        top = np.argpartition(d2, k - 1, axis=1)[:, :k] # k nearest, unordered
+    else:
+        top = np.tile(np.arange(d2.shape[1]), (d2.shape[0], 1))
     
-    for i in range(train.shape[0]):
+    out_labels = np.empty(d2.shape[0], dtype=np.int32)
+    out_votes = np.empty(d2.shape[0], dtype=np.int32)
+    out_dist = np.empty(d2.shape[0], dtype=np.float32)
+    for i in range(d2.shape[0]):
+        # Same vote as the old knn: majority label, ties go to the smallest label
+        values, counts = np.unique(labels[top[i]], return_counts=True)
+        index = np.argmax(counts)
+        out_labels[i] = values[index]
+        out_votes[i] = counts[index]
+        winners = top[i][labels[top[i]] == values[index]]
+        out_dist[i] = np.sqrt(d2[i, winners].min())
+    return out_labels, out_votes, out_dist
+
+
+def coarse_features(features, size=20, face_size=100, chunk_rows=1024):
+    # 100x100 BGR rows -> size x size grayscale block means (30,000 -> 400 values for size=20)
+    block = face_size // size
+    weights = np.array([0.114, 0.587, 0.299], dtype=np.float32) # BGR to gray, same weights as cv2
+    out = np.empty((features.shape[0], size * size), dtype=np.float32)
+    for start in range(0, features.shape[0], chunk_rows):
+        chunk = np.asarray(features[start:start + chunk_rows], dtype=np.float32)
+        gray = chunk.reshape((-1, face_size, face_size, 3)) @ weights
+        small = gray.reshape((-1, size, block, size, block)).mean(axis=(2, 4))
+        out[start:start + chunk_rows] = small.reshape((-1, size * size))
+    return out
+
+
+class CoarseToFineMatcher:
+    # Ranks every gallery row on a 20x20 grayscale thumbnail, then re-ranks only the best
+    # `candidates` rows with the exact full-resolution distance. The full gallery stays uint8
+    # (memory-mapped); only the candidate rows are read and converted per query.
+    def __init__(self, features, labels, coarse, k=5, candidates=200, size=20):
+        self.features = features
+        self.labels = np.asarray(labels).astype(np.int32)
+        self.coarse = np.asarray(coarse, dtype=np.float32)
+        self.coarse_norms = np.einsum("ij,ij->i", self.coarse, self.coarse)
+        self.k = k
+        self.candidates = max(k, candidates)
+        self.size = size
+
+    def predict(self, queries, exclude=None):
+        queries = np.atleast_2d(queries)
+        q_coarse = coarse_features(queries, self.size)
+        q_norms = np.einsum("ij,ij->i", q_coarse, q_coarse)
+        d2_coarse = q_norms[:, None] - 2.0 * (q_coarse @ self.coarse.T) + self.coarse_norms[None, :]
+        if exclude is not None:
+            d2_coarse[np.arange(d2_coarse.shape[0]), exclude] = np.inf
+        
+        n = min(self.candidates, d2_coarse.shape[1])
+        if n < d2_coarse.shape[1]:
+            shortlist = np.argpartition(d2_coarse, n - 1, axis=1)[:, :n]
+        else:
+            shortlist = np.tile(np.arange(d2_coarse.shape[1]), (d2_coarse.shape[0], 1))
+        
+        out_labels = np.empty(queries.shape[0], dtype=np.int32)
+        out_votes = np.empty(queries.shape[0], dtype=np.int32)
+        out_dist = np.empty(queries.shape[0], dtype=np.float32)
+        for i in range(queries.shape[0]):
+            rows = np.sort(shortlist[i]) # sorted rows read the memory-mapped gallery sequentially
+            diff = np.asarray(self.features[rows], dtype=np.float32) - queries[i].astype(np.float32)
+            d2 = np.einsum("ij,ij->i", diff, diff)[None, :]
+            if exclude is not None:
+                d2[0, rows == exclude[i]] = np.inf
+            label, votes, dist = vote_top_k(d2, self.labels[rows], self.k)
+            out_labels[i], out_votes[i], out_dist[i] = label[0], votes[0], dist[0]
+        return out_labels, out_votes, out_dist
+
+
+def matcher_agreement(reference, candidate, queries, exclude=None):
+    # Share of queries where two matchers pick the same label (e.g. coarse-to-fine vs the full KNN)
+    expected, _, _ = reference.predict(queries, exclude)
+    got, _, _ = candidate.predict(queries, exclude)
+    return float((expected == got).mean()) if len(expected) else 1.0
+
+
+def knn(train, test, k=5):
+    if isinstance(train, FaceGallery):
+        matcher = KNNMatcher.from_gallery(train, k)
+    else:
         #train is a 2D NumPy array where each row represents a training sample where last column is label
-        ix = train[i, :-1] #ix is used to store the feature vector (all features except the label) 
-        iy = train[i, -1] #iy is a variable used to store the label (class) of the current training sample.
-        d = distance(test, ix)
-        dist.append([d, iy])
+        matcher = KNNMatcher(train[:, :-1], train[:, -1], k)
+    labels, _, _ = matcher.predict(test)
+    return labels[0]
+
+
+class PCAProjector:
+    # Eigenface basis fitted incrementally, so it can be updated per student without the whole gallery in RAM
+    def __init__(self, n_components=200):
+        self.n_components = n_components
+        self.mean = None
+        self.components = None
+        self.singular_values = None
+        self.n_samples_seen = 0
+
+    def partial_fit(self, batch):
+        batch = np.asarray(batch, dtype=np.float64)
+        batch_mean = batch.mean(axis=0)
+        
+        if self.n_samples_seen == 0:
+            stack = batch - batch_mean
+            new_mean = batch_mean
+        else:
+            # Merge the old basis (scaled by its singular values) with the new rows and a mean-shift row
+            n, m = self.n_samples_seen, batch.shape[0]
+            new_mean = (n * self.mean + m * batch_mean) / (n + m)
+            mean_correction = np.sqrt(n * m / (n + m)) * (self.mean - batch_mean)
+            stack = np.vstack((
+                self.singular_values[:, None] * self.components,
+                batch - batch_mean,
+                mean_correction,
+            ))
+        
+        _, sv, vt = np.linalg.svd(stack, full_matrices=False)
+        keep = min(self.n_components, vt.shape[0])
+        self.components = vt[:keep]
+        self.singular_values = sv[:keep]
+        self.mean = new_mean
+        self.n_samples_seen += batch.shape[0]
+        return self
+
+    def fit(self, features, chunk_rows=256):
+        self.mean = self.components = self.singular_values = None
+        self.n_samples_seen = 0
+        for start in range(0, features.shape[0], chunk_rows):
+            self.partial_fit(features[start:start + chunk_rows])
+        return self
+
+    def transform(self, features, chunk_rows=1024):
+        components = self.components.astype(np.float32)
+        mean = self.mean.astype(np.float32)
+        out = np.empty((features.shape[0], components.shape[0]), dtype=np.float32)
+        for start in range(0, features.shape[0], chunk_rows):
+            chunk = np.asarray(features[start:start + chunk_rows], dtype=np.float32)
+            out[start:start + chunk_rows] = (chunk - mean) @ components.T
+        return out
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            mean=self.mean,
+            components=self.components,
+            singular_values=self.singular_values,
+            n_samples_seen=self.n_samples_seen,
+            n_components=self.n_components,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            projector = cls(int(data["n_components"]))
+            projector.mean = data["mean"]
+            projector.components = data["components"]
+            projector.singular_values = data["singular_values"]
+            projector.n_samples_seen = int(data["n_samples_seen"])
+        return projector
+
+
+def _gallery_paths():
+    # The consolidated gallery lives in a hidden folder so it is never mistaken for a student file
+    gallery_dir = os.path.join(DATASET_DIR, ".gallery")
+    return {
+        "dir": gallery_dir,
+        "features": os.path.join(gallery_dir, "features.npy"),
+        "labels": os.path.join(gallery_dir, "labels.npy"),
+        "meta": os.path.join(gallery_dir, "meta.json"),
+        "pca": os.path.join(gallery_dir, "pca_basis.npz"),
+        "projected": os.path.join(gallery_dir, "projected.npy"),
+        "projected_meta": os.path.join(gallery_dir, "projected.json"),
+        "coarse": os.path.join(gallery_dir, "coarse.npy"),
+        "coarse_check": os.path.join(gallery_dir, "coarse_check.json"),
+    }
+
+
+def _dataset_fingerprint():
+    # Directory mtime changes whenever a student file is added, removed or renamed
+    return os.stat(DATASET_DIR).st_mtime_ns
+
+
+def invalidate_gallery():
+    # The meta file is written last, so removing it is enough to force a rebuild
+    meta_path = _gallery_paths()["meta"]
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+
+def build_gallery():
+    paths = _gallery_paths()
+    os.makedirs(paths["dir"], exist_ok=True)
+    invalidate_gallery()
+    fingerprint = _dataset_fingerprint()
     
-    dk = sorted(dist, key=lambda x: x[0])[:k]
-    labels = np.array(dk)[:, -1]
-    output = np.unique(labels, return_counts=True)
-    index = np.argmax(output[1])
-    return output[0][index]
+    npy_files = sorted(f for f in os.listdir(DATASET_DIR) if f.endswith(".npy"))
+    if not npy_files:
+        return False
+    
+    # First pass only reads the .npy headers, so we know the final size without loading any pixels
+    sources = [np.load(os.path.join(DATASET_DIR, fx), mmap_mode="r") for fx in npy_files]
+    total_rows = sum(src.shape[0] for src in sources)
+    dim = sources[0].shape[1]
+    
+    features_tmp = paths["features"] + ".tmp"
+    features = np.lib.format.open_memmap(features_tmp, mode="w+", dtype=np.uint8, shape=(total_rows, dim))
+    labels = np.empty(total_rows, dtype=np.int32)
+    offsets = []
+    
+    row = 0
+    for class_id, src in enumerate(sources):
+        n = src.shape[0]
+        features[row:row + n] = src # copied one student at a time, peak RAM stays at one student
+        labels[row:row + n] = class_id
+        offsets.append(row)
+        row += n
+    
+    features.flush()
+    del features, sources
+    
+    labels_tmp = paths["labels"] + ".tmp.npy"
+    np.save(labels_tmp, labels)
+    os.replace(features_tmp, paths["features"])
+    os.replace(labels_tmp, paths["labels"])
+    
+    meta = {
+        "names": [fx[:-4] for fx in npy_files], # Removing .npy for Getting Name
+        "offsets": offsets,
+        "rows": total_rows,
+        "dim": dim,
+        "fingerprint": fingerprint,
+    }
+    with open(paths["meta"], "w") as f:
+        json.dump(meta, f)
+    return True
 
 
-def load_face_data():
-    face_data = []
-    labels = []
-    class_id = 0
-    names = {}
+def load_class_index(gallery, db_module):
+    # {class_id: [labels]}, read fresh from the roster every time (one small SELECT), so a student
+    # moved to another class is searched in the new class from the next session on
+    roster = db_module.get_student_classes()
+    index = {}
+    for label in range(gallery.student_count):
+        class_id = roster.get(gallery.student_id_of(label))
+        if class_id is not None:
+            index.setdefault(class_id, []).append(label)
+    return index
+
+
+def load_gallery(class_id=None, db_module=None):
+    if class_id is not None:
+        # A session for one class only searches (and only pages in) that class's students
+        gallery = load_gallery()
+        if gallery is None:
+            return None
+        labels = load_class_index(gallery, db_module).get(int(class_id), [])
+        return gallery.subset(labels) if labels else None
     
-    try:
-        npy_files = [f for f in os.listdir(DATASET_DIR) if f.endswith(".npy")]
-    except Exception as e:
-        return None, None
+    paths = _gallery_paths()
+    meta = None
     
-    if not npy_files:
+    if os.path.exists(paths["meta"]):
+        try:
+            with open(paths["meta"], "r") as f:
+                meta = json.load(f)
+        except Exception:
+            meta = None
+    
+    if meta is None or meta.get("fingerprint") != _dataset_fingerprint():
+        try:
+            if not build_gallery():
+                return None
+            with open(paths["meta"], "r") as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"Error building face gallery: {str(e)}")
+            return None
+    
+    # Memory-mapped, so only the pages the matcher touches are read from disk
+    features = np.load(paths["features"], mmap_mode="r")
+    labels = np.load(paths["labels"], mmap_mode="r")
+    return FaceGallery(features, labels, meta["names"], meta["offsets"])
+
+
+def load_projection(gallery, n_components=200):
+    # Loads the stored basis (fitting it on the gallery the first time) plus the projected gallery rows
+    paths = _gallery_paths()
+    if gallery.source is not None:
+        projector, projected = load_projection(gallery.source, n_components)
+        return projector, np.asarray(projected[gallery.rows])
+    
+    projector = None
+    if os.path.exists(paths["pca"]):
+        try:
+            projector = PCAProjector.load(paths["pca"])
+        except Exception:
+            projector = None
+    if projector is None or projector.n_components != n_components:
+        projector = PCAProjector(n_components).fit(gallery.features)
+        projector.save(paths["pca"])
+    
+    # The projected rows are reused until either the gallery or the basis changes
+    stamp = [os.stat(paths["features"]).st_mtime_ns, os.stat(paths["pca"]).st_mtime_ns]
+    if os.path.exists(paths["projected"]) and os.path.exists(paths["projected_meta"]):
+        with open(paths["projected_meta"], "r") as f:
+            if json.load(f).get("stamp") == stamp:
+                return projector, np.load(paths["projected"], mmap_mode="r")
+    
+    projected = projector.transform(gallery.features)
+    np.save(paths["projected"], projected)
+    with open(paths["projected_meta"], "w") as f:
+        json.dump({"stamp": stamp}, f)
+    return projector, projected
+
+
+def update_projection(face_data):
+    # Folds a newly enrolled student into an existing basis instead of refitting from scratch
+    pca_path = _gallery_paths()["pca"]
+    if not os.path.exists(pca_path):
+        return False
+    
+    projector = PCAProjector.load(pca_path)
+    projector.partial_fit(face_data)
+    projector.save(pca_path)
+    return True
+
+
+def refit_projection(n_components=200):
+    # Full refit, e.g. after students were deleted (incremental updates can only add data)
+    gallery = load_gallery()
+    if gallery is None:
+        return None
+    
+    projector = PCAProjector(n_components).fit(gallery.features)
+    projector.save(_gallery_paths()["pca"])
+    return projector
+
+
+def load_coarse(gallery):
+    # Thumbnails are cached next to the gallery and rebuilt whenever features.npy changes
+    paths = _gallery_paths()
+    if gallery.source is not None:
+        return np.asarray(load_coarse(gallery.source)[gallery.rows])
+    if os.path.exists(paths["coarse"]) and os.stat(paths["coarse"]).st_mtime_ns >= os.stat(paths["features"]).st_mtime_ns:
+        coarse = np.load(paths["coarse"], mmap_mode="r")
+        if coarse.shape[0] == len(gallery):
+            return coarse
+    
+    coarse = coarse_features(gallery.features)
+    np.save(paths["coarse"], coarse)
+    return coarse
+
+
+def coarse_agreement(gallery, k=5, candidates=200, count=64):
+    # How often the coarse search picks the same student as the full KNN, measured leave-one-out on
+    # `count` gallery rows (each query's own row is hidden from both searches). Costs a full pass
+    # over the gallery, so it is cached beside coarse.npy and only rerun when either file changes.
+    if gallery.source is not None:
+        return coarse_agreement(gallery.source, k, candidates, count)
+    paths = _gallery_paths()
+    coarse = load_coarse(gallery)
+    stamp = [os.stat(paths["features"]).st_mtime_ns, os.stat(paths["coarse"]).st_mtime_ns, k, candidates, count]
+    if os.path.exists(paths["coarse_check"]):
+        try:
+            with open(paths["coarse_check"], "r") as f:
+                data = json.load(f)
+            if data.get("stamp") == stamp:
+                return data["agreement"]
+        except Exception:
+            pass
+    
+    rows = np.linspace(0, len(gallery) - 1, min(count, len(gallery))).astype(int)
+    queries = np.asarray(gallery.features[rows])
+    full = KNNMatcher.from_gallery(gallery, k)
+    matcher = CoarseToFineMatcher(gallery.features, gallery.labels, coarse, k, candidates)
+    agreement = matcher_agreement(full, matcher, queries, exclude=rows)
+    with open(paths["coarse_check"], "w") as f:
+        json.dump({"stamp": stamp, "agreement": agreement}, f)
+    return agreement
+
+
+def build_matcher(gallery, config=None, k=5):
+    # search_mode "coarse" takes precedence over use_pca; both fall back to the full KNN
+    config = config or {}
+    if config.get("search_mode") == "coarse":
+        candidates = int(config.get("coarse_candidates", 200))
+        tolerance = float(config.get("coarse_tolerance", 0.02))
+        agreement = coarse_agreement(gallery, k, candidates)
+        if agreement < 1.0 - tolerance:
+            print(f"Coarse search agrees with the full KNN on {agreement:.1%} of held-out faces "
+                  f"(tolerance {tolerance:.1%}); using the full search")
+            return KNNMatcher.from_gallery(gallery, k)
+        return CoarseToFineMatcher(gallery.features, gallery.labels, load_coarse(gallery), k, candidates=candidates)
+    if config.get("use_pca"):
+        projector, projected = load_projection(gallery, int(config.get("pca_components", 200)))
+        return KNNMatcher(projected, gallery.labels, k, projector=projector)
+    return KNNMatcher.from_gallery(gallery, k)
+
+
+def load_face_data():
+    gallery = load_gallery()
+    if gallery is None:
         return None, None
     
-    for fx in npy_files:
-        names[class_id] = fx[:-4] # Removing .npy for Getting Name
-        data_item = np.load(os.path.join(DATASET_DIR, fx))
-        face_data.append(data_item)
-        target = class_id * np.ones((data_item.shape[0])) # The target variable is used to give every photo of a person their ID.
-        class_id += 1
-        labels.append(target)
+    names = dict(enumerate(gallery.names))
+    return names, gallery
+
+
+class _Pacer:
+    # Sleeps so frames come out at a fixed rate measured from the first frame (no drift from slow reads)
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self.start = None
+        self.count = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+        delay = self.start + self.count * self.interval - now
+        if delay > 0:
+            time.sleep(delay)
+        self.count += 1
+
+
+class CameraSource:
+    def __init__(self, index=0):
+        self.cap = cv2.VideoCapture(index)
+        self.finished = False # a camera never runs out of frames
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource:
+    # realtime=True plays at the file's own frame rate, realtime=False as fast as frames can be decoded
+    def __init__(self, path, realtime=True):
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if realtime else 0
+        self.pacer = _Pacer(fps or (30 if realtime else 0))
+        self.finished = False
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        if self.finished:
+            return False, None
+        self.pacer.wait()
+        ret, frame = self.cap.read()
+        if not ret:
+            self.finished = True
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource:
+    # Frames are the folder's images in file-name order, so every replay sees exactly the same sequence
+    def __init__(self, folder, fps=30, realtime=True):
+        self.paths = [
+            os.path.join(folder, fx) for fx in sorted(os.listdir(folder))
+            if fx.lower().endswith((".png", ".jpg", ".jpeg", ".bmp"))
+        ]
+        self.pacer = _Pacer(fps if realtime else 0)
+        self.index = 0
+        self.finished = not self.paths
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        while self.index < len(self.paths):
+            self.pacer.wait()
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        self.finished = True
+        return False, None
+
+    def release(self):
+        self.index = len(self.paths)
+
+
+def open_frame_source(source=None, config=None, realtime=True, fps=30):
+    # source may be a camera index, a video file or an image folder; None falls back to the config
+    config = config or {}
+    if source is None or source == "":
+        source = config.get("video_source") or config.get("camera_index", 0)
     
-    face_dataset = np.concatenate(face_data, axis=0)# stacks all the face data vertically into one big array from this [[1.1, 2.2, 3.3]] to [1.1, 2.2, 3.3]
-    face_labels = np.concatenate(labels, axis=0).reshape((-1, 1)) # Get a single, one-dimensional array with all labels and to give same id to same face
-    trainset = np.concatenate((face_dataset, face_labels), axis=1) #As to give dataset a label
+    if isinstance(source, int) or str(source).isdigit():
+        return CameraSource(int(source))
+    if os.path.isdir(source):
+        return ImageSequenceSource(source, fps, realtime)
+    return VideoFileSource(source, realtime)
+
+
+def crop_face(frame, box, offset=5):
+    x, y, w, h = box
+    #Padding
+    face_section = frame[max(y - offset, 0): y + h + offset,
+                        max(x - offset, 0): x + w + offset]
+    if face_section.size == 0:
+        return None
+    return cv2.resize(face_section, (100, 100))
+
+
+class FaceDetector:
+    # Runs the Haar cascade on a downscaled grayscale frame and maps boxes back to full-resolution coordinates
+    def __init__(self, config=None):
+        config = config or {}
+        self.scale = float(config.get("detection_scale", 1.0))
+        self.min_size = int(config.get("min_face_size", 0)) # in full-resolution pixels, 0 = no limit
+        self.max_size = int(config.get("max_face_size", 0))
+        self.cascade = cv2.CascadeClassifier(HAARCASCADE_PATH)
+
+    def detect(self, frame):
+        with perf.time("cvtColor"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = self.scale
+        if scale != 1.0:
+            with perf.time("downscale"):
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        options = {}
+        if self.min_size:
+            options["minSize"] = (int(self.min_size * scale),) * 2
+        if self.max_size:
+            options["maxSize"] = (int(self.max_size * scale),) * 2
+        
+        with perf.time("detectMultiScale"):
+            faces = self.cascade.detectMultiScale(gray, 1.3, 6, **options)
+        return [tuple(int(round(v / scale)) for v in box) for box in faces]
+
+
+def kmeans_prototypes(rows, n, iterations=10, seed=0):
+    # Plain k-means on one student's samples; returns at most n uint8 prototype rows
+    rows = np.asarray(rows)
+    if n <= 0 or rows.shape[0] <= n:
+        return rows.astype(np.uint8)
+    
+    data = rows.astype(np.float32)
+    rng = np.random.default_rng(seed)
+    centers = data[rng.choice(data.shape[0], n, replace=False)]
+    sq_norms = np.einsum("ij,ij->i", data, data)
     
-    return names, trainset
+    for _ in range(iterations):
+        d2 = sq_norms[:, None] - 2.0 * (data @ centers.T) + np.einsum("ij,ij->i", centers, centers)[None, :]
+        assign = np.argmin(d2, axis=1)
+        new_centers = centers.copy()
+        for c in range(n):
+            members = data[assign == c]
+            if len(members):
+                new_centers[c] = members.mean(axis=0)
+            else:
+                new_centers[c] = data[np.argmax(d2.min(axis=1))] # re-seed an empty cluster on the worst-fit sample
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    return np.clip(np.rint(centers), 0, 255).astype(np.uint8)
+
+
+def _raw_path(name):
+    # Every recorded sample is kept here once the top-level file holds prototypes
+    return os.path.join(DATASET_DIR, ".raw", f"{name}.npy")
 
 
-def record_face(name, samples=50):
+def condense_student(name, n):
+    raw_file = _raw_path(name)
+    face_file = os.path.join(DATASET_DIR, f"{name}.npy")
+    if not os.path.exists(raw_file):
+        if not os.path.exists(face_file):
+            return None
+        os.makedirs(os.path.dirname(raw_file), exist_ok=True)
+        os.replace(face_file, raw_file)
+    
+    raw = np.load(raw_file)
+    if n > 0:
+        rows = kmeans_prototypes(raw, n)
+    else:
+        rows = raw # n = 0 restores the full sample set
+    np.save(face_file, rows)
+    return raw.shape[0], rows.shape[0]
+
+
+def evaluate_condensation(n, holdout=0.2, max_students=None):
+    # Fits prototypes on the first (1 - holdout) of each student's raw samples and
+    # scores the held-out rest against both the full and the condensed gallery
+    names = sorted(f[:-4] for f in os.listdir(DATASET_DIR) if f.endswith(".npy"))[:max_students]
+    full_rows, full_labels, proto_rows, proto_labels, queries, expected = [], [], [], [], [], []
+    
+    for label, name in enumerate(names):
+        source = _raw_path(name) if os.path.exists(_raw_path(name)) else os.path.join(DATASET_DIR, f"{name}.npy")
+        raw = np.load(source)
+        split = max(1, int(raw.shape[0] * (1 - holdout)))
+        if split >= raw.shape[0]:
+            continue
+        train, test = raw[:split], raw[split:]
+        protos = kmeans_prototypes(train, n)
+        full_rows.append(train)
+        full_labels.append(np.full(train.shape[0], label, dtype=np.int32))
+        proto_rows.append(protos)
+        proto_labels.append(np.full(protos.shape[0], label, dtype=np.int32))
+        queries.append(test)
+        expected.append(np.full(test.shape[0], label, dtype=np.int32))
+    
+    if not queries:
+        return None
+    
+    queries = np.concatenate(queries)
+    expected = np.concatenate(expected)
+    report = {"students": len(full_rows), "held_out_samples": int(len(expected))}
+    for key, rows, labels in (
+        ("full", full_rows, full_labels),
+        ("condensed", proto_rows, proto_labels),
+    ):
+        rows = np.concatenate(rows)
+        matcher = KNNMatcher(rows, np.concatenate(labels))
+        start = time.perf_counter()
+        predicted, _, _ = matcher.predict(queries)
+        elapsed = (time.perf_counter() - start) * 1000
+        report[key] = {
+            "gallery_rows": int(rows.shape[0]),
+            "gallery_bytes": int(rows.nbytes),
+            "ms_per_face": elapsed / len(queries),
+            "accuracy": float((predicted == expected).mean()),
+        }
+    return report
+
+
+def condense_dataset(n, evaluate=False):
+    # Maintenance: re-condenses every enrolled student to n prototypes (n = 0 restores all samples)
+    report = {"prototypes_per_student": n, "rows_before": 0, "rows_after": 0, "students": 0}
+    if evaluate:
+        report["evaluation"] = evaluate_condensation(n)
+    
+    for fx in sorted(os.listdir(DATASET_DIR)):
+        if not fx.endswith(".npy"):
+            continue
+        counts = condense_student(fx[:-4], n)
+        if counts:
+            report["students"] += 1
+            report["rows_before"] += counts[0]
+            report["rows_after"] += counts[1]
+    
+    invalidate_gallery()
+    return report
+
+
+def migrate_face_files(db_module):
+    # One-off: renames legacy <name>.npy files to <student_id>.npy when the name matches exactly one student
+    renamed = 0
+    skipped = 0
+    ids_by_name = {}
+    for student_id, info in db_module.get_student_identity_map().items():
+        ids_by_name.setdefault(info["name"], []).append(student_id)
+    
+    for fx in sorted(os.listdir(DATASET_DIR)):
+        stem = fx[:-4]
+        if not fx.endswith(".npy") or stem.isdigit():
+            continue
+        ids = ids_by_name.get(stem, [])
+        if not ids:
+            reason = "no student has this name"
+        elif len(ids) > 1:
+            reason = f"{len(ids)} students share this name ({', '.join(str(i) for i in sorted(ids))})"
+        elif os.path.exists(os.path.join(DATASET_DIR, f"{ids[0]}.npy")):
+            reason = f"student {ids[0]} already has face data"
+        else:
+            reason = None
+        if reason:
+            # These faces have no student id, so they can be recognised but never marked
+            print(f"Face file {fx} not migrated: {reason}")
+            skipped += 1
+            continue
+        os.replace(os.path.join(DATASET_DIR, fx), os.path.join(DATASET_DIR, f"{ids[0]}.npy"))
+        if os.path.exists(_raw_path(stem)):
+            os.replace(_raw_path(stem), _raw_path(str(ids[0])))
+        renamed += 1
+    
+    if renamed:
+        invalidate_gallery()
+    if skipped:
+        print(f"{skipped} face file(s) are still keyed by name and cannot be marked; re-enrol those students")
+    return renamed
+
+
+def record_face(student_id, name, samples=50, config=None, source=None):
     speak(f"Recording face for {name}")
+    if config is None:
+        config = load_config()
     
     try:
-        cap = cv2.VideoCapture(0)
-        face_cascade = cv2.CascadeClassifier(HAARCASCADE_PATH)
+        cap = open_frame_source(source, config)
+        detector = FaceDetector(config)
         face_data = []
         skip = 0
         
         while True:
             ret, frame = cap.read()
             if not ret:
+                if cap.finished: # end of a recorded video or image folder
+                    break
                 continue
             
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.3, 6)
+            faces = detector.detect(frame)
             
             if len(faces) == 0:
                 cv2.putText(frame, "No face detected", (50, 50),
@@ -152,14 +1055,9 @@ def record_face(name, samples=50):
             
             faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
             x, y, w, h = faces[0] #Using [:1] to handle one face at a time
-            #Padding
-            offset = 5
-            
-            face_section = frame[max(y - offset, 0): y + h + offset,
-                                max(x - offset, 0): x + w + offset]
-            face_selection = cv2.resize(face_section, (100, 100))
+            face_selection = crop_face(frame, faces[0])
             
-            if skip % 5 == 0:
+            if skip % 5 == 0 and face_selection is not None:
                 face_data.append(face_selection)
             
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
@@ -172,8 +1070,23 @@ def record_face(name, samples=50):
             if cv2.waitKey(1) & 0xFF == ord('q') and len(face_data) > 20:
                 break
         
+        if not face_data:
+            cap.release()
+            cv2.destroyAllWindows()
+            return False
+        
         face_data = np.array(face_data).reshape((len(face_data), -1)) # flatten makes this [[1],[2]] to [1, 2]
-        np.save(os.path.join(DATASET_DIR, name), face_data)
+        key = str(student_id) # files are keyed by student id, so renames and duplicate names are safe
+        prototypes = int(config.get("prototypes_per_student", 0))
+        if prototypes > 0:
+            # Keep every sample in .raw/ and enrol only the prototypes
+            os.makedirs(os.path.dirname(_raw_path(key)), exist_ok=True)
+            np.save(_raw_path(key), face_data)
+            condense_student(key, prototypes)
+        else:
+            np.save(os.path.join(DATASET_DIR, key), face_data)
+        invalidate_gallery()
+        update_projection(face_data)
         
         cap.release()
         cv2.destroyAllWindows()
@@ -185,62 +1098,487 @@ def record_face(name, samples=50):
         print(f"Error recording face: {str(e)}")
         return False
 
-def recognize_and_mark_attendance(db_module):
-    loaded = load_face_data()
-    if loaded == (None, None):
+class LatestValue:
+    # Single-slot mailbox: writers overwrite, readers always get the newest value and never a backlog
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._seq = 0
+
+    def set(self, value):
+        with self._cond:
+            self._value = value
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            return self._seq, self._value
+
+    def wait_newer(self, seq, timeout=0.1):
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout)
+            return self._seq, self._value
+
+
+def _put_latest(q, item):
+    # Bounded queue that drops its oldest item instead of blocking the producer
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTrack:
+    def __init__(self, track_id, box, history=15):
+        self.track_id = track_id
+        self.box = box
+        self.votes = deque(maxlen=history) # one KNN label per recognition of this face
+        self.scores = deque(maxlen=history) # (KNN votes, nearest distance) for each of those labels
+        self.missed = 0
+        self.detections_since_recognition = 0
+
+    def identity(self):
+        # Majority over the vote history, so a single bad KNN result does not flip the name
+        if not self.votes:
+            return None, 0
+        values, counts = np.unique(np.array(self.votes), return_counts=True)
+        index = np.argmax(counts)
+        return int(values[index]), int(counts[index])
+
+    def last_score(self, label):
+        for vote_label, score in zip(reversed(self.votes), reversed(self.scores)):
+            if vote_label == label:
+                return score
+        return 0, float("inf")
+
+    def confident_label(self, threshold, max_distance=0, stable=3, k=5, label_rows=None):
+        # The last `stable` recognitions must agree, each with enough KNN votes and (optionally) a close match.
+        # A student condensed to fewer than k prototypes can never win enough votes, and a plurality over
+        # a few prototypes says little, so those students are only confident on a max_distance match.
+        if len(self.votes) < stable:
+            return None
+        recent_votes = list(self.votes)[-stable:]
+        recent_scores = list(self.scores)[-stable:]
+        if len(set(recent_votes)) != 1:
+            return None
+        label = recent_votes[0]
+        if label_rows is not None and label_rows[label] < k:
+            if not max_distance:
+                return None
+            k = max(1, int(label_rows[label]))
+        for votes, dist in recent_scores:
+            if votes / k < threshold or (max_distance and dist > max_distance):
+                return None
+        return label
+
+
+class FaceTracker:
+    # Matches detected boxes to existing tracks by IoU, so the same student is recognised once, not every frame
+    def __init__(self, iou_threshold=0.3, max_missed=3, recognize_every=10, stable_frames=3):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.recognize_every = recognize_every
+        self.warmup_votes = max(3, stable_frames) # enough back-to-back votes for confident_label to decide
+        self.tracks = []
+        self.lost = False
+        self._next_id = 1
+
+    def update(self, boxes):
+        # Returns (track, needs_recognition) for every box, in the same order as boxes
+        pairs = sorted(
+            ((box_iou(track.box, box), ti, bi) for ti, track in enumerate(self.tracks) for bi, box in enumerate(boxes)),
+            reverse=True,
+        )
+        matched_tracks = {}
+        matched_boxes = {}
+        for iou, ti, bi in pairs: # greedy: best overlaps first
+            if iou < self.iou_threshold:
+                break
+            if ti in matched_tracks or bi in matched_boxes:
+                continue
+            matched_tracks[ti] = bi
+            matched_boxes[bi] = ti
+        
+        self.lost = False
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti in matched_tracks:
+                track.missed = 0
+                survivors.append(track)
+            else:
+                track.missed += 1
+                self.lost = True
+                if track.missed <= self.max_missed:
+                    survivors.append(track)
+        
+        out = []
+        for bi, box in enumerate(boxes):
+            if bi in matched_boxes:
+                track = self.tracks[matched_boxes[bi]]
+                track.box = box
+                track.detections_since_recognition += 1
+            else:
+                track = FaceTrack(self._next_id, box)
+                self._next_id += 1
+                survivors.append(track)
+            
+            # New or still-unsettled faces are recognised straight away, settled ones only now and then
+            needs = len(track.votes) < self.warmup_votes or track.detections_since_recognition >= self.recognize_every
+            out.append((track, needs))
+        
+        self.tracks = survivors
+        return out
+
+
+Detection = namedtuple("Detection", ["box", "label", "student_id", "student", "distance", "votes", "track_id", "confident"])
+
+
+class RecognitionEngine:
+    # Headless recognition: frames (BGR numpy arrays) in, Detection tuples and stage timings out.
+    # detect() and recognize() may run on two different threads, but each on only one.
+    def __init__(self, gallery, matcher, config=None, identities=None):
+        config = config or {}
+        self.config = config
+        self.gallery = gallery
+        self.matcher = matcher
+        self.identities = identities or {} # student_id -> {"name", "grno", "class_id"}, loaded once
+        self.label_rows = np.bincount(gallery.labels, minlength=gallery.student_count) # samples per student
+        self.detector = FaceDetector(config)
+        self.detect_every = max(1, int(config.get("detect_every_n_frames", 3)))
+        self.threshold = float(config.get("recognition_threshold", 0.6))
+        self.max_distance = float(config.get("max_match_distance", 0))
+        self.stable_frames = max(1, int(config.get("auto_mark_stable_frames", 3)))
+        self.tracker = FaceTracker(
+            recognize_every=int(config.get("recognize_every_n_detections", 10)),
+            stable_frames=self.stable_frames,
+        )
+        self.redetect = threading.Event() # set when the tracker loses a face
+        self.last_detections = []
+        self._since_detection = self.detect_every
+
+    @classmethod
+    def load(cls, config=None, class_id=None, db_module=None):
+        gallery = load_gallery(class_id, db_module)
+        if gallery is None:
+            return None
+        identities = db_module.get_student_identity_map() if db_module is not None else None
+        return cls(gallery, build_matcher(gallery, config), config, identities)
+
+    def student_of(self, label):
+        student_id = self.gallery.student_id_of(label)
+        info = self.identities.get(student_id)
+        return student_id, info["name"] if info else self.gallery.name_of(label)
+
+    def should_detect(self):
+        # Between detections the tracks keep their last boxes; a lost track forces an early re-detect
+        self._since_detection += 1
+        if self._since_detection < self.detect_every and not self.redetect.is_set():
+            return False
+        self._since_detection = 0
+        self.redetect.clear()
+        return True
+
+    def detect(self, frame):
+        start = time.perf_counter()
+        boxes = []
+        queries = []
+        for box in self.detector.detect(frame):
+            with perf.time("resize"):
+                face_section = crop_face(frame, box) # cropped from the full-resolution frame
+            if face_section is None:
+                continue
+            boxes.append(box)
+            queries.append(face_section.flatten()) # flatten makes this [[1],[2]] to [1, 2]
+        elapsed = (time.perf_counter() - start) * 1000
+        perf.record("detect", elapsed)
+        return boxes, queries, {"detect_ms": elapsed}
+
+    def recognize(self, boxes, queries):
+        start = time.perf_counter()
+        tracked = self.tracker.update(boxes)
+        if self.tracker.lost:
+            self.redetect.set()
+        
+        pending = [(track, query) for (track, needs), query in zip(tracked, queries) if needs]
+        if pending:
+            # Only new or unsettled faces are scored, all of them in one batch
+            with perf.time("knn"):
+                out, votes, dists = self.matcher.predict(np.array([query for _, query in pending]))
+            for (track, _), label, vote, dist in zip(pending, out, votes, dists):
+                track.votes.append(int(label))
+                track.scores.append((int(vote), float(dist)))
+                track.detections_since_recognition = 0
+        
+        detections = []
+        for track, _ in tracked:
+            label, _ = track.identity()
+            confident = track.confident_label(
+                self.threshold, self.max_distance, self.stable_frames, self.matcher.k, self.label_rows
+            )
+            if confident is not None:
+                label = confident
+            if label is None:
+                continue
+            votes, distance = track.last_score(label)
+            student_id, student = self.student_of(label)
+            detections.append(Detection(
+                track.box, label, student_id, student, distance, votes, track.track_id, confident is not None
+            ))
+        
+        self.last_detections = detections
+        elapsed = (time.perf_counter() - start) * 1000
+        perf.record("recognize", elapsed)
+        perf.tick("recognition")
+        return detections, {"recognize_ms": elapsed, "scored": len(pending)}
+
+    def process(self, frame):
+        # Synchronous path for headless callers and benchmarks
+        if not self.should_detect():
+            return self.last_detections, {"detect_ms": 0.0, "recognize_ms": 0.0, "scored": 0}
+        boxes, queries, timings = self.detect(frame)
+        detections, recognize_timings = self.recognize(boxes, queries)
+        timings.update(recognize_timings)
+        return detections, timings
+
+
+class RecognitionPipeline:
+    # capture thread -> detection thread -> recognition thread around a RecognitionEngine,
+    # each stage only ever works on the newest data
+    def __init__(self, cap, engine, queue_size=2):
+        self.cap = cap
+        self.engine = engine
+        self.frames = LatestValue() # newest camera frame
+        self.results = LatestValue() # newest list of Detection tuples
+        self.detections = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.finished = threading.Event() # set when a recorded source runs out of frames
+        self.error = None # (stage, exception) from the first worker that failed
+        self.dropped_frames = 0
+        self.threads = [
+            threading.Thread(target=self._guard, args=("capture", self._capture_loop), name="capture", daemon=True),
+            threading.Thread(target=self._guard, args=("detect", self._detect_loop), name="detect", daemon=True),
+            threading.Thread(target=self._guard, args=("recognize", self._recognize_loop), name="recognize", daemon=True),
+        ]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for t in self.threads:
+            t.join(timeout)
+
+    def _guard(self, stage, loop):
+        # A failing stage stops the whole pipeline instead of dying silently and leaving stale results on screen
+        try:
+            loop()
+        except Exception as e:
+            if self.error is None:
+                self.error = (stage, e)
+            print(f"Error in {stage} thread: {str(e)}")
+            self.stop_event.set()
+
+    def _capture_loop(self):
+        while not self.stop_event.is_set():
+            with perf.time("capture"):
+                ret, frame = self.cap.read()
+            if not ret:
+                if getattr(self.cap, "finished", False):
+                    self.finished.set()
+                    return
+                time.sleep(0.01)
+                continue
+            self.frames.set(frame)
+            perf.tick("camera")
+
+    def _detect_loop(self):
+        seen = 0
+        while not self.stop_event.is_set():
+            seq, frame = self.frames.wait_newer(seen)
+            if frame is None or seq == seen:
+                continue
+            self.dropped_frames += seq - seen - 1 # frames the camera delivered while we were busy
+            seen = seq
+            
+            if not self.engine.should_detect():
+                continue
+            boxes, queries, _ = self.engine.detect(frame)
+            _put_latest(self.detections, (boxes, queries))
+
+    def _recognize_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                boxes, queries = self.detections.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            detections, _ = self.engine.recognize(boxes, queries)
+            self.results.set(detections)
+
+
+def replay(engine, source, max_frames=None):
+    # Pushes every frame of a source through the engine synchronously (no dropped frames), for regression runs
+    frames = 0
+    faces = 0
+    start = time.perf_counter()
+    try:
+        while max_frames is None or frames < max_frames:
+            ret, frame = source.read()
+            if not ret:
+                if source.finished:
+                    break
+                continue
+            detections, _ = engine.process(frame)
+            frames += 1
+            faces += len(detections)
+    finally:
+        source.release()
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": frames,
+        "faces": faces,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def draw_perf_overlay(frame, summary):
+    # Right-aligned block: FPS counters, then p50/p95 per stage
+    lines = [f"{name} {value:.1f} fps" for name, value in summary["fps"].items()]
+    lines += [f"{stage} {st['p50']:.1f}/{st['p95']:.1f} ms" for stage, st in summary["stages"].items()]
+    x = frame.shape[1] - 260
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, (x, 25 + i * 20),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+
+def recognize_and_mark_attendance(db_module, config=None, source=None, class_id=None):
+    if config is None:
+        config = load_config()
+    
+    # gallery norms (and the PCA projection) are computed once per session
+    engine = RecognitionEngine.load(config, class_id, db_module)
+    if engine is None:
         return None
     
-    names, trainset = loaded
-    current_date = str(datetime.date.today())
-    current_time = datetime.datetime.now().strftime("%H:%M:%S")
+    report = engine.gallery.memory_report()
+    print(f"Gallery: {report['students']} students, {report['samples']} samples, "
+          f"{report['bytes_per_student'] / 1024:.0f} KB per student")
+    
     marked_students = []
+    auto_mark = bool(config.get("auto_mark"))
+    if auto_mark and not engine.max_distance and engine.label_rows.min() < engine.matcher.k:
+        print(f"Auto-mark: students with fewer than {engine.matcher.k} samples (condensed) are only "
+              "auto-marked when max_match_distance is set")
     
     speak("Starting face recognition")
     
     cap = None
+    pipeline = None
+    session = None
     try:
-        cap = cv2.VideoCapture(0)
+        session = db_module.AttendanceSession() # today's marks are checked in memory from here on
+        cap = open_frame_source(source, config)
         if not cap.isOpened():
             print("Error: Cannot open camera")
             return None
-            
-        face_cascade = cv2.CascadeClassifier(HAARCASCADE_PATH)
         
-        matched_name = None
+        pipeline = RecognitionPipeline(cap, engine).start()
+        
+        matched = None
         last_marked = None
         status_message = ""
         message_timer = 0
+        auto_handled = set() # track ids that auto-mark already acted on
+        
+        def try_mark(det):
+            with perf.time("mark"):
+                _try_mark(det)
+        
+        def _try_mark(det):
+            nonlocal last_marked, status_message, message_timer
+            name = det.student
+            student_id = det.student_id # identity map lookup, no name search in the database
+            
+            if student_id in engine.identities:
+                current_time = datetime.datetime.now().strftime("%H:%M:%S")
+                
+                if session.mark(student_id, current_time, "P"):
+                    speak(f"{name} marked present")
+                    marked_students.append(name)
+                    last_marked = name
+                    status_message = f"SUCCESS: {name} marked!"
+                    message_timer = 90
+                    print(f"✓ {name} marked present at {current_time}")
+                else:
+                    speak(f"{name} already marked", key=f"already:{name}")
+                    status_message = f"ALREADY MARKED: {name}"
+                    message_timer = 90
+                    print(f"! {name} already marked today")
+            else:
+                status_message = f"ERROR: {name} not in database"
+                message_timer = 90
+                print(f"✗ Student {name} not found in database")
+        
+        frame_seq = 0
+        show_perf = True
+        perf.reset()
         
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            # The display only waits for the camera; detection and KNN never hold it up
+            if pipeline.error is not None:
+                stage, error = pipeline.error
+                raise RuntimeError(f"{stage} stage failed: {error}") from error
+            
+            seq, frame = pipeline.frames.wait_newer(frame_seq)
+            if frame is None or seq == frame_seq:
+                if pipeline.finished.is_set() or cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
                 continue
+            frame_seq = seq
+            frame = frame.copy() # the worker threads may still be reading the original
             
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.3, 6)
+            perf.tick("display")
             
-            matched_name = None
+            matched = None
+            _, results = pipeline.results.get()
             
-            for (x, y, w, h) in faces:
-                #Padding
-                offset = 5
-                face_section = frame[max(y-offset, 0): y+h+offset,
-                                    max(x-offset, 0): x+w+offset]
-                
-                if face_section.size == 0:
-                    continue
+            for det in results or []:
+                x, y, w, h = det.box
+                color = (0, 255, 0) if det.confident else (0, 200, 255) # amber until the identity is stable
+                cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+                cv2.putText(frame, det.student, (x, y - 10),
+                           cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
                 
-                face_section = cv2.resize(face_section, (100, 100))
-                out = knn(trainset, face_section.flatten()) #knn function will compare the detected face's features with the training data (trainset) and return the predicted label and flatten makes this [[1],[2]] to [1, 2] 
-                candidate_name = names[int(out)]
+                matched = det
                 
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                cv2.putText(frame, candidate_name, (x, y - 10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                
-                matched_name = candidate_name
+                # Hands-free: each stable, confident track is marked once
+                if auto_mark and det.confident and det.track_id not in auto_handled:
+                    auto_handled.add(det.track_id)
+                    try_mark(det)
+            
+            if show_perf:
+                draw_perf_overlay(frame, perf.summary())
             
-            cv2.putText(frame, "Press 'N' to mark | 'Q' to quit", (10, 30),
+            help_text = "AUTO MARK on | 'P' stats | 'Q' to quit" if auto_mark else "Press 'N' to mark | 'P' stats | 'Q' to quit"
+            cv2.putText(frame, help_text, (10, 30),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             
             cv2.putText(frame, f"Marked: {len(marked_students)}", (10, 60),
@@ -259,29 +1597,11 @@ def recognize_and_mark_attendance(db_module):
             
             key = cv2.waitKey(1) & 0xFF
             
-            if key == ord('n') and matched_name:
-                student = db_module.get_student_by_name(matched_name)
-                
-                if student:
-                    student_id = student[0]
-                    
-                    if not db_module.check_attendance_exists(student_id, current_date):
-                        db_module.mark_attendance(student_id, current_date, current_time, "P")
-                        speak(f"{matched_name} marked present")
-                        marked_students.append(matched_name)
-                        last_marked = matched_name
-                        status_message = f"SUCCESS: {matched_name} marked!"
-                        message_timer = 90
-                        print(f"✓ {matched_name} marked present at {current_time}")
-                    else:
-                        speak(f"{matched_name} already marked")
-                        status_message = f"ALREADY MARKED: {matched_name}"
-                        message_timer = 90
-                        print(f"! {matched_name} already marked today")
-                else:
-                    status_message = f"ERROR: {matched_name} not in database"
-                    message_timer = 90
-                    print(f"✗ Student {matched_name} not found in database")
+            if key == ord('n') and matched:
+                try_mark(matched)
+            
+            if key == ord('p'):
+                show_perf = not show_perf
             
             if key == ord('q'):
                 break
@@ -298,15 +1618,34 @@ def recognize_and_mark_attendance(db_module):
         return None
         
     finally:
+        if pipeline is not None:
+            pipeline.stop() # join the workers before the camera goes away under the capture thread
         if cap is not None:
             cap.release()
+        if session is not None:
+            unsaved = session.close() # drains the write-behind queue (with retries) before returning
+            writes = session.writer.stats()
+            print(f"Attendance writes: {writes['written']} saved in {writes['batches']} batches, "
+                  f"{writes['skipped']} already present, {writes['failed_attempts']} failed attempts")
+            for student_id, _, _, _ in unsaved:
+                name = engine.identities.get(student_id, {}).get("name", str(student_id))
+                if name in marked_students:
+                    marked_students.remove(name) # the returned list only holds marks that reached the database
+                print(f"✗ {name} could not be saved; please mark again")
         cv2.destroyAllWindows()
         cv2.waitKey(1)
 
-def delete_face_data(name):
-    face_file = os.path.join(DATASET_DIR, f"{name}.npy")
-    if os.path.exists(face_file):
-        os.remove(face_file)
+def delete_face_data(student_id, name=None):
+    # Removes the id-keyed file and, if still around, a legacy name-keyed one
+    for key in (str(student_id), name):
+        if not key:
+            continue
+        face_file = os.path.join(DATASET_DIR, f"{key}.npy")
+        if os.path.exists(_raw_path(key)):
+            os.remove(_raw_path(key))
+        if os.path.exists(face_file):
+            os.remove(face_file)
+            invalidate_gallery()
 
 
 def validate_phone_number(phone):
@@ -346,4 +1685,37 @@ def export_to_csv(data, headers, filename):
         return True
     except Exception as e:
         print(f"Export error: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+def export_chunks_to_csv(chunks, headers, filename, total=None, progress=None, cancelled=None):
+    # Streams row chunks (e.g. db_logic.iter_attendance_reports) to a CSV through a temp file that only
+    # replaces filename once complete, so a cancelled or failed export leaves nothing half-written.
+    # Returns the number of rows written, or None if cancelled or failed
+    import csv
+    
+    tmp = filename + ".part"
+    written = 0
+    try:
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(headers) # column headers
+            for rows in chunks:
+                if cancelled is not None and cancelled.is_set():
+                    break
+                writer.writerows(rows)
+                written += len(rows)
+                if progress is not None:
+                    progress(written, total)
+        if cancelled is not None and cancelled.is_set():
+            if hasattr(chunks, "close"):
+                chunks.close() # release the cursor now rather than whenever the generator is collected
+            os.remove(tmp)
+            return None
+        os.replace(tmp, filename)
+        return written
+    except Exception as e:
+        print(f"Export error: {str(e)}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend
+from common import write_results
+
+
+def load_frames(path, max_frames=200):
+    # A directory of images or a video file, decoded once up front so decoding is not timed
+    frames = []
+    if os.path.isdir(path):
+        for fx in sorted(os.listdir(path)):
+            if fx.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")):
+                frame = cv2.imread(os.path.join(path, fx))
+                if frame is not None:
+                    frames.append(frame)
+            if len(frames) >= max_frames:
+                break
+    else:
+        cap = cv2.VideoCapture(path)
+        while len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+def recall(reference, detected, iou_threshold=0.5):
+    # Share of full-resolution detections that the downscaled run also found
+    hits = 0
+    for ref in reference:
+        if any(backend.box_iou(ref, box) >= iou_threshold for box in detected):
+            hits += 1
+    return hits, len(reference)
+
+
+def bench_scales(frames, scales, min_size=0, max_size=0, repeat=3):
+    reference_detector = backend.FaceDetector({"detection_scale": 1.0, "min_face_size": min_size, "max_face_size": max_size})
+    reference = [reference_detector.detect(frame) for frame in frames]
+    
+    results = []
+    for scale in scales:
+        detector = backend.FaceDetector({"detection_scale": scale, "min_face_size": min_size, "max_face_size": max_size})
+        timings = []
+        hits = total = 0
+        for frame, ref in zip(frames, reference):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                boxes = detector.detect(frame)
+                timings.append((time.perf_counter() - start) * 1000)
+            h, t = recall(ref, boxes)
+            hits += h
+            total += t
+        
+        results.append({
+            "scale": scale,
+            "mean_ms": float(np.mean(timings)),
+            "p95_ms": float(np.percentile(timings, 95)),
+            "recall": hits / total if total else None,
+            "reference_faces": total,
+            "frames": len(frames),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Haar cascade latency and recall at several detection scales")
+    parser.add_argument("frames", help="directory of recorded frames or a video file")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.35, 0.25])
+    parser.add_argument("--min-face-size", type=int, default=0)
+    parser.add_argument("--max-face-size", type=int, default=0)
+    parser.add_argument("--max-frames", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    
+    backend.check_and_download_haarcascade(backend.HAARCASCADE_PATH)
+    frames = load_frames(args.frames, args.max_frames)
+    if not frames:
+        print(f"No frames found in {args.frames}")
+        return 1
+    
+    results = bench_scales(frames, args.scales, args.min_face_size, args.max_face_size, args.repeat)
+    
+    print(f"{len(frames)} frames, {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'scale':>6} {'mean ms':>9} {'p95 ms':>9} {'recall':>7}")
+    for r in results:
+        rec = f"{r['recall']:.3f}" if r["recall"] is not None else "n/a"
+        print(f"{r['scale']:>6.2f} {r['mean_ms']:>9.2f} {r['p95_ms']:>9.2f} {rec:>7}")
+    
+    if args.output:
+        write_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
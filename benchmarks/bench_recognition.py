@@ -0,0 +1,112 @@
+import argparse
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from common import timeit, write_results
+import backend
+import synthetic
+
+
+def bench_gallery(students, samples, queries=20, repeat=3, pca_components=200, coarse_candidates=200, tolerance=0.02):
+    tmp = tempfile.mkdtemp(prefix="attendancepro_faces_")
+    previous_dir = backend.DATASET_DIR
+    backend.DATASET_DIR = tmp
+    try:
+        synthetic.generate_gallery(tmp, students, samples)
+        q, expected = synthetic.make_queries(tmp, queries)
+        result = {"students": students, "samples": samples, "timings": {}, "accuracy": {}}
+        timings = result["timings"]
+        
+        timings["build_gallery"] = timeit(backend.build_gallery, 1, warmup=0)
+        timings["load_face_data"] = timeit(backend.load_face_data, repeat)
+        gallery = backend.load_gallery()
+        result["memory"] = gallery.memory_report()
+        
+        # The original per-row loop is only timed on small galleries, it takes seconds per face beyond that
+        if len(gallery) <= 5000:
+            trainset = np.concatenate((gallery.features, gallery.labels.reshape((-1, 1))), axis=1)
+            timings["knn_legacy_per_face"] = timeit(lambda: legacy_knn(trainset, q[0]), repeat)
+        
+        matchers = {"knn_matcher": backend.build_matcher(gallery, {})}
+        if pca_components:
+            matchers["knn_pca"] = backend.build_matcher(gallery, {"use_pca": True, "pca_components": pca_components})
+        if coarse_candidates:
+            matchers["knn_coarse"] = backend.build_matcher(
+                gallery, {"search_mode": "coarse", "coarse_candidates": coarse_candidates, "coarse_tolerance": 1.0}
+            )
+        for name, matcher in matchers.items():
+            batch = timeit(lambda: matcher.predict(q), repeat)
+            timings[f"{name}_per_face"] = {k: v / len(q) if k.endswith("_ms") else v for k, v in batch.items()}
+            result["accuracy"][name] = float((matcher.predict(q)[0] == expected).mean())
+        
+        if coarse_candidates:
+            agreement = backend.matcher_agreement(matchers["knn_matcher"], matchers["knn_coarse"], q)
+            result["coarse_agreement"] = agreement
+            result["coarse_within_tolerance"] = agreement >= 1.0 - tolerance
+        return result
+    finally:
+        backend.DATASET_DIR = previous_dir
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def legacy_knn(train, test, k=5):
+    # Copy of the original backend.knn loop, kept here as the baseline
+    dist = []
+    for i in range(train.shape[0]):
+        ix = train[i, :-1]
+        iy = train[i, -1]
+        dist.append([backend.distance(test, ix), iy])
+    dk = sorted(dist, key=lambda x: x[0])[:k]
+    labels = np.array(dk)[:, -1]
+    output = np.unique(labels, return_counts=True)
+    return output[0][np.argmax(output[1])]
+
+
+def bench_detection(frames=20, repeat=3, size=(480, 640)):
+    # Fixed synthetic frames: measures cascade cost per frame, not recall (see bench_detection.py for that)
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, size + (3,), dtype=np.uint8) for _ in range(frames)]
+    detector = backend.FaceDetector(backend.load_config())
+    run = timeit(lambda: [detector.detect(img) for img in images], repeat)
+    return {k: v / frames if k.endswith("_ms") else v for k, v in run.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gallery loading, KNN and detection benchmarks on synthetic galleries")
+    parser.add_argument("--students", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--samples", type=int, default=20, help="samples per student")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pca-components", type=int, default=200, help="0 skips the PCA matcher")
+    parser.add_argument("--coarse-candidates", type=int, default=200, help="0 skips the coarse-to-fine matcher")
+    parser.add_argument("--tolerance", type=float, default=None, help="defaults to coarse_tolerance from the config")
+    parser.add_argument("--output", default="bench_recognition.json")
+    args = parser.parse_args(argv)
+    
+    tolerance = args.tolerance if args.tolerance is not None else backend.load_config().get("coarse_tolerance", 0.02)
+    results = {"galleries": [], "detection_per_frame": None}
+    for students in args.students:
+        print(f"{students} students x {args.samples} samples")
+        r = bench_gallery(
+            students, args.samples, args.queries, args.repeat,
+            args.pca_components, args.coarse_candidates, tolerance,
+        )
+        for name, t in r["timings"].items():
+            print(f"  {name:<24} {t['median_ms']:>10.3f} ms")
+        if "coarse_agreement" in r:
+            verdict = "ok" if r["coarse_within_tolerance"] else "OUT OF TOLERANCE"
+            print(f"  coarse vs full agreement {r['coarse_agreement']:>10.3f} ({verdict})")
+        results["galleries"].append(r)
+    
+    backend.check_and_download_haarcascade(backend.HAARCASCADE_PATH)
+    results["detection_per_frame"] = bench_detection(repeat=args.repeat)
+    print(f"  detection per frame      {results['detection_per_frame']['median_ms']:>10.3f} ms")
+    write_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def timeit(fn, repeat=5, warmup=1):
+    # Returns timings in milliseconds; the warm-up runs fill caches and are not counted
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.mean(samples),
+        "runs": repeat,
+    }
+
+
+def environment():
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        revision = None
+    
+    info = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    try:
+        import numpy
+        info["numpy"] = numpy.__version__
+    except ImportError:
+        pass
+    try:
+        import sqlite3
+        info["sqlite"] = sqlite3.sqlite_version
+    except ImportError:
+        pass
+    return info
+
+
+def write_results(results, path):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=4)
+    print(f"Results written to {path}")
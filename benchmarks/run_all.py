@@ -0,0 +1,40 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from common import environment
+
+import bench_db
+import bench_recognition
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs every AttendancePro benchmark and writes one JSON report")
+    parser.add_argument("--students", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--db-students", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--days", type=int, default=365 * 3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+    
+    tmp = tempfile.mkdtemp(prefix="attendancepro_bench_")
+    parts = {}
+    bench_recognition.main([
+        "--students", *map(str, args.students), "--output", os.path.join(tmp, "recognition.json"),
+    ])
+    bench_db.main([
+        "--students", *map(str, args.db_students), "--days", str(args.days), "--output", os.path.join(tmp, "db.json"),
+    ])
+    for name in ("recognition", "db"):
+        with open(os.path.join(tmp, f"{name}.json")) as f:
+            parts[name] = json.load(f)["results"]
+    
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "results": parts}, f, indent=4)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
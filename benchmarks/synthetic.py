@@ -0,0 +1,86 @@
+import datetime
+import os
+import random
+import sqlite3
+
+import common  # noqa: F401  (puts the project root on sys.path)
+import db_logic
+
+
+def generate_gallery(dataset_dir, students, samples=20, dim=30000, noise=25, seed=0):
+    # One .npy per student like record_face writes: a random "face" plus per-sample noise, as uint8 rows
+    import numpy as np
+    
+    rng = np.random.default_rng(seed)
+    os.makedirs(dataset_dir, exist_ok=True)
+    for i in range(students):
+        base = rng.integers(0, 256, dim, dtype=np.int16)
+        rows = base + rng.normal(0, noise, (samples, dim))
+        np.save(os.path.join(dataset_dir, f"student_{i:05d}"), np.clip(rows, 0, 255).astype(np.uint8))
+    return dataset_dir
+
+
+def make_queries(dataset_dir, count=20, noise=25, seed=1):
+    # Fresh noisy samples of enrolled students, with the label each one should match
+    import numpy as np
+    
+    rng = np.random.default_rng(seed)
+    files = sorted(f for f in os.listdir(dataset_dir) if f.endswith(".npy"))
+    queries = []
+    labels = []
+    for _ in range(count):
+        label = int(rng.integers(0, len(files)))
+        rows = np.load(os.path.join(dataset_dir, files[label]), mmap_mode="r")
+        row = rows[int(rng.integers(0, rows.shape[0]))].astype(np.int16)
+        queries.append(np.clip(row + rng.normal(0, noise, row.shape), 0, 255).astype(np.uint8))
+        labels.append(label)
+    return np.array(queries), np.array(labels)
+
+
+def seed_database(db_path, students=500, classes=10, days=365 * 3, attendance_rate=0.9, seed=0):
+    # Creates the normal schema through db_logic.init_db, then bulk-loads students and years of attendance
+    rnd = random.Random(seed)
+    db_logic.DB_PATH = db_path
+    db_logic.init_db()
+    
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    now = str(datetime.datetime.now())
+    cur.executemany(
+        "INSERT INTO classes (name, description, created_at) VALUES (?, ?, ?)",
+        [(f"Class {c}", "synthetic", now) for c in range(1, classes)],
+    )
+    cur.execute("SELECT id FROM classes")
+    class_ids = [row[0] for row in cur.fetchall()]
+    
+    cur.executemany(
+        """
+        INSERT INTO students (grno, rollno, name, std, section, gender, phoneno, class_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                100000 + i, i % 60 + 1, f"Student {i:05d}", 1 + i % 12, "ABCD"[i % 4],
+                "MF"[i % 2], f"98{i:08d}", class_ids[i % len(class_ids)], now,
+            )
+            for i in range(students)
+        ],
+    )
+    cur.execute("SELECT id FROM students")
+    student_ids = [row[0] for row in cur.fetchall()]
+    
+    today = datetime.date.today()
+    rows = 0
+    for d in range(days):
+        date = str(today - datetime.timedelta(days=d))
+        batch = [
+            (sid, date, f"{8 + rnd.randint(0, 1):02d}:{rnd.randint(0, 59):02d}:00", "P")
+            for sid in student_ids if rnd.random() < attendance_rate
+        ]
+        cur.executemany(
+            "INSERT INTO attendance (student_id, date, time, status) VALUES (?, ?, ?, ?)", batch
+        )
+        rows += len(batch)
+    conn.commit()
+    conn.close()
+    return {"students": students, "classes": classes, "days": days, "attendance_rows": rows}
@@ -1,7 +1,15 @@
 import sqlite3
+import atexit
+import codecs
+import csv
 import datetime
+import functools
+import locale
 import os
+import queue
 import sys
+import threading
+import time
 
 # Base paths
 if getattr(sys, "frozen", False):
@@ -11,12 +19,68 @@ else:
 
 DB_PATH = os.path.join(BASE_DIR, "attendance.db")
 
+_timing_hook = None
+
+
+def set_timing_hook(hook):
+    # hook(name, ms) is called after every timed query; the app points it at backend.perf.record
+    global _timing_hook
+    _timing_hook = hook
+
+
+def timed(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        hook = _timing_hook
+        if hook is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            hook(f"db.{fn.__qualname__}", (time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+# Connection tuning; see get_db_connection
+BUSY_TIMEOUT_MS = 10000
+CACHE_SIZE_KB = 20000
+CACHED_STATEMENTS = 512
+
+_local = threading.local()
+
+
+def _open_connection(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS)
+    # WAL lets the Tk thread and workers read while the recognition writer commits
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
 
 def get_db_connection():
-    return sqlite3.connect(DB_PATH)
+    # One long-lived connection per thread, so nothing is shared across threads; reopened if DB_PATH changes
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+
+def close_db_connection():
+    # Worker threads call this before exiting; the main thread's connection lives for the app
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cur = conn.cursor()
 
     # Existing tables
@@ -76,6 +140,43 @@ def init_db():
                 "ALTER TABLE attendance RENAME COLUMN studentid TO student_id"
             )
 
+    # One mark per student per day. Older databases may hold duplicates; keep the first mark of each day
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_attendance_student_date'")
+    if cur.fetchone() is None:
+        cur.execute(
+            """
+            DELETE FROM attendance
+            WHERE id NOT IN (SELECT MIN(id) FROM attendance GROUP BY student_id, date)
+            """
+        )
+        if cur.rowcount > 0:
+            print(f"Removed {cur.rowcount} duplicate attendance rows")
+    cur.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance (student_id, date)"
+    )
+    # Covers the per-day dashboard counts and the date-range reports
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_attendance_date_status ON attendance (date, status, student_id, time)"
+    )
+
+    # Per-day, per-class rollup behind the dashboard numbers, kept current by the triggers below
+    if "daily_summary" not in tables:
+        cur.execute(
+            """
+            CREATE TABLE daily_summary (
+                date TEXT NOT NULL,
+                class_id INTEGER NOT NULL DEFAULT 0,
+                present INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (date, class_id)
+            )
+            """
+        )
+        _create_summary_triggers(cur)
+        _rebuild_daily_summary(cur)
+    else:
+        _create_summary_triggers(cur)
+
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS settings (
@@ -94,25 +195,106 @@ def init_db():
         )
 
     conn.commit()
-    conn.close()
+
+    # Planner statistics, so name-filtered reports start from students instead of the whole date range.
+    # Sampled (analysis_limit) so start-up stays fast on large tables; PRAGMA optimize refreshes them later
+    cur.execute("PRAGMA analysis_limit=1000")
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+    if cur.fetchone() is None:
+        cur.execute("SELECT 1 FROM attendance LIMIT 1")
+        if cur.fetchone() is not None:
+            cur.execute("ANALYZE")
+    cur.execute("PRAGMA optimize")
+
+
+# class_id 0 stands for "no class" so it can be part of the summary's primary key
+_SUMMARY_CLASS = "COALESCE((SELECT class_id FROM students WHERE id = {row}.student_id), 0)"
+
+_SUMMARY_ADD = """
+    INSERT INTO daily_summary (date, class_id, present, total)
+    VALUES ({row}.date, {cls}, {row}.status = 'P', 1)
+    ON CONFLICT (date, class_id) DO UPDATE
+    SET present = present + excluded.present, total = total + 1;
+"""
+
+_SUMMARY_REMOVE = """
+    UPDATE daily_summary
+    SET present = present - ({row}.status = 'P'), total = total - 1
+    WHERE date = {row}.date AND class_id = {cls};
+"""
+
+
+def _create_summary_triggers(cur):
+    add_new = _SUMMARY_ADD.format(row="NEW", cls=_SUMMARY_CLASS.format(row="NEW"))
+    remove_old = _SUMMARY_REMOVE.format(row="OLD", cls=_SUMMARY_CLASS.format(row="OLD"))
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_summary_insert AFTER INSERT ON attendance BEGIN {add_new} END")
+    # delete_student removes attendance before the student row, so the class lookup still resolves
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_summary_delete AFTER DELETE ON attendance BEGIN {remove_old} END")
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_summary_update AFTER UPDATE OF student_id, date, status ON attendance
+        BEGIN {remove_old} {add_new} END
+        """
+    )
+    # A student changing class moves their history to the new class row
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_summary_class_change AFTER UPDATE OF class_id ON students
+        WHEN OLD.class_id IS NOT NEW.class_id
+        BEGIN
+            UPDATE daily_summary
+            SET present = present - (SELECT COUNT(*) FROM attendance a
+                                     WHERE a.student_id = NEW.id AND a.date = daily_summary.date AND a.status = 'P'),
+                total = total - (SELECT COUNT(*) FROM attendance a
+                                 WHERE a.student_id = NEW.id AND a.date = daily_summary.date)
+            WHERE class_id = COALESCE(OLD.class_id, 0)
+              AND date IN (SELECT date FROM attendance WHERE student_id = NEW.id);
+            INSERT INTO daily_summary (date, class_id, present, total)
+            SELECT date, COALESCE(NEW.class_id, 0), status = 'P', 1 FROM attendance WHERE student_id = NEW.id
+            ON CONFLICT (date, class_id) DO UPDATE
+            SET present = present + excluded.present, total = total + excluded.total;
+        END
+        """
+    )
 
 
-def add_student(grno, rollno, name, std, section, gender, phoneno, class_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def _rebuild_daily_summary(cur):
+    cur.execute("DELETE FROM daily_summary")
     cur.execute(
         """
-        INSERT INTO students (grno, rollno, name, std, section, gender, phoneno, class_id, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (grno, rollno, name, std, section, gender, phoneno, class_id, str(datetime.datetime.now())),
+        INSERT INTO daily_summary (date, class_id, present, total)
+        SELECT a.date, COALESCE(s.class_id, 0), SUM(a.status = 'P'), COUNT(*)
+        FROM attendance a
+        LEFT JOIN students s ON a.student_id = s.id
+        GROUP BY a.date, COALESCE(s.class_id, 0)
+        """
     )
-    conn.commit()
-    student_id = cur.lastrowid
-    conn.close()
-    return student_id
+    return cur.rowcount
+
+
+@timed
+def rebuild_daily_summary():
+    # Recomputes the rollup from raw attendance; returns the number of (date, class) rows
+    conn = get_db_connection()
+    with conn:
+        return _rebuild_daily_summary(conn.cursor())
 
 
+@timed
+def add_student(grno, rollno, name, std, section, gender, phoneno, class_id):
+    conn = get_db_connection()
+    with conn: # commits, or rolls back so a failed insert does not hold the write lock
+        cur = conn.execute(
+            """
+            INSERT INTO students (grno, rollno, name, std, section, gender, phoneno, class_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (grno, rollno, name, std, section, gender, phoneno, class_id, str(datetime.datetime.now())),
+        )
+    return cur.lastrowid
+
+
+@timed
 def get_all_students(search_term=None):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -136,73 +318,70 @@ def get_all_students(search_term=None):
             """
         )
     students = cur.fetchall()
-    conn.close()
     return students
 
 
+@timed
 def get_student_by_id(student_id):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT * FROM students WHERE id = ?", (student_id,))
     student = cur.fetchone()
-    conn.close()
     return student
 
+@timed
 def get_student_by_name(name):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT * FROM students WHERE name LIKE ?", (f"%{name}%",)) # fuzzy search
     student = cur.fetchone()
-    conn.close()
     return student
 
+@timed
 def update_student(student_id, grno, rollno, name, std, section, gender, phoneno):
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE students
-        SET grno = ?, rollno = ?, name = ?, std = ?, section = ?, gender = ?, phoneno = ?
-        WHERE id = ?
-        """,
-        (grno, rollno, name, std, section, gender, phoneno, student_id),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            """
+            UPDATE students
+            SET grno = ?, rollno = ?, name = ?, std = ?, section = ?, gender = ?, phoneno = ?
+            WHERE id = ?
+            """,
+            (grno, rollno, name, std, section, gender, phoneno, student_id),
+        )
 
 
+@timed
 def delete_student(student_id):
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM attendance WHERE student_id = ?", (student_id,))
-    cur.execute("DELETE FROM students WHERE id = ?", (student_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("DELETE FROM attendance WHERE student_id = ?", (student_id,))
+        conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
 
 
+@timed
 def get_student_count():
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM students")
     count = cur.fetchone()[0]
-    conn.close()
     return count
 
 
+@timed
 def mark_attendance(student_id, date, time, status="P"):
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO attendance (student_id, date, time, status)
-        VALUES (?, ?, ?, ?)
-        """,
-        (student_id, date, time, status),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO attendance (student_id, date, time, status)
+            VALUES (?, ?, ?, ?)
+            """,
+            (student_id, date, time, status),
+        )
 
 
+@timed
 def check_attendance_exists(student_id, date):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -211,50 +390,260 @@ def check_attendance_exists(student_id, date):
         (student_id, date),
     )
     row = cur.fetchone()
-    conn.close()
     return row is not None
 
 
+class AttendanceWriter:
+    # Write-behind queue for marks: one background thread commits them in batches instead of one fsync per mark.
+    # A batch that fails (e.g. "database is locked" while another kiosk writes) is kept and retried with backoff.
+    def __init__(self, batch_size=50, flush_interval=0.25, max_backoff=10.0, close_timeout=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.close_timeout = close_timeout
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.saved = threading.Condition()
+        self.outstanding = 0 # submitted but not yet committed
+        self.close_deadline = None
+        self.unsaved = [] # rows still failing when close() gave up
+        self.written = 0
+        self.skipped = 0 # rows the table already had (e.g. marked by another kiosk)
+        self.retrying = 0
+        self.failed_attempts = 0
+        self.batches = 0
+        self.max_backlog = 0
+        self.last_flush_ms = 0.0
+
+    def submit(self, student_id, date, time, status="P"):
+        with self.lock:
+            if self.thread is None:
+                self.close_deadline = None
+                self.unsaved = []
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+                atexit.register(self.close) # a clean interpreter exit still drains the queue
+        with self.saved:
+            self.outstanding += 1
+        self.queue.put((student_id, date, time, status))
+        self.max_backlog = max(self.max_backlog, self.queue.qsize())
+
+    def flush(self, timeout=None):
+        # Blocks until everything submitted so far is committed; False if that did not happen within timeout
+        with self.saved:
+            return self.saved.wait_for(lambda: self.outstanding == 0, timeout)
+
+    def close(self):
+        # Drains the queue, retrying failed rows for up to close_timeout seconds.
+        # Returns the rows that could still not be saved (empty when everything was committed)
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.close_deadline = time.monotonic() + self.close_timeout
+            self.queue.put(None)
+            thread.join()
+            atexit.unregister(self.close)
+            if self.unsaved:
+                print(f"Error: {len(self.unsaved)} attendance marks could not be saved: {self.unsaved}")
+        return self.unsaved
+
+    def stats(self):
+        return {
+            "backlog": self.queue.qsize(),
+            "max_backlog": self.max_backlog,
+            "written": self.written,
+            "skipped": self.skipped,
+            "retrying": self.retrying,
+            "failed_attempts": self.failed_attempts,
+            "unsaved": len(self.unsaved),
+            "batches": self.batches,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    def _run(self):
+        conn = get_db_connection()
+        pending = [] # rows from a failed write, retried (together with newer marks) once the backoff expires
+        backoff = 0.0
+        retry_at = 0.0
+        stopping = False
+        while True:
+            batch = []
+            if not stopping:
+                if pending:
+                    deadline = retry_at
+                else:
+                    batch.append(self.queue.get())
+                    # Collect until the batch is full or the oldest mark has waited flush_interval
+                    deadline = time.monotonic() + self.flush_interval
+                while not batch or batch[-1] is not None:
+                    if not pending and len(batch) >= self.batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            
+            stopping = stopping or (bool(batch) and batch[-1] is None)
+            rows = pending + [row for row in batch if row is not None]
+            if rows:
+                if self._write(conn, rows):
+                    pending = []
+                    backoff = 0.0
+                    with self.saved:
+                        self.outstanding -= len(rows)
+                        self.saved.notify_all()
+                else:
+                    pending = rows
+                    backoff = min(max(backoff * 2, 0.5), self.max_backoff)
+                    retry_at = time.monotonic() + backoff
+            self.retrying = len(pending)
+            
+            if stopping:
+                if not pending:
+                    break
+                if time.monotonic() + backoff > self.close_deadline:
+                    self.unsaved = pending
+                    with self.saved:
+                        self.outstanding -= len(pending) # handed back to close(), so flush() does not hang
+                        self.saved.notify_all()
+                    break
+                time.sleep(backoff)
+        close_db_connection()
+
+    def _write(self, conn, rows):
+        # True once the rows are committed; False leaves them for the caller to retry
+        start = time.perf_counter()
+        ok = True
+        try:
+            with conn:
+                # The unique (student_id, date) index keeps the once-per-student-per-day rule
+                cur = conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO attendance (student_id, date, time, status)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+            self.written += cur.rowcount
+            self.skipped += len(rows) - cur.rowcount
+            self.batches += 1
+        except sqlite3.Error as e:
+            ok = False
+            self.failed_attempts += 1
+            print(f"Error writing {len(rows)} attendance marks, will retry: {e}")
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        hook = _timing_hook
+        if hook is not None:
+            hook("db.AttendanceWriter.flush", self.last_flush_ms)
+        return ok
+
+
+class AttendanceSession:
+    # One recognition session: today's marked ids are loaded once, new marks go to the write-behind queue
+    def __init__(self, date=None, writer=None):
+        self.date = date or str(datetime.date.today())
+        self.writer = writer or AttendanceWriter()
+        self.lock = threading.Lock()
+        conn = get_db_connection()
+        cur = conn.execute("SELECT DISTINCT student_id FROM attendance WHERE date = ?", (self.date,))
+        self.marked = {row[0] for row in cur.fetchall()}
+
+    def mark(self, student_id, time, status="P"):
+        # True if the mark was queued; False if the student already had one today
+        with self.lock:
+            if student_id in self.marked:
+                return False
+            self.marked.add(student_id)
+        self.writer.submit(student_id, self.date, time, status)
+        return True
+
+    def close(self):
+        # Returns the marks that could not be saved; they are dropped from `marked` so the caller can report them
+        unsaved = self.writer.close()
+        with self.lock:
+            for row in unsaved:
+                self.marked.discard(row[0])
+        return unsaved
+
+
+@timed
 def get_attendance_count_today():
     conn = get_db_connection()
     cur = conn.cursor()
     today = str(datetime.date.today())
-    cur.execute(
-        "SELECT COUNT(DISTINCT student_id) FROM attendance WHERE date = ? AND status = 'P'",
-        (today,),
-    )
+    cur.execute("SELECT COALESCE(SUM(present), 0) FROM daily_summary WHERE date = ?", (today,))
     count = cur.fetchone()[0]
-    conn.close()
     return count
 
 
+@timed
 def get_total_attendance_today():
     conn = get_db_connection()
     cur = conn.cursor()
     today = str(datetime.date.today())
-    cur.execute("SELECT COUNT(*) FROM attendance WHERE date = ?", (today,))
+    cur.execute("SELECT COALESCE(SUM(total), 0) FROM daily_summary WHERE date = ?", (today,))
     count = cur.fetchone()[0]
-    conn.close()
     return count
 
 
-def get_attendance_last_n_days(ndays=7):
+@timed
+def get_attendance_range(from_date, to_date, group_by=None, class_id=None, student_id=None):
+    # Students present per day over [from_date, to_date] in one GROUP BY query; missing days are zero-filled.
+    # group_by=None returns (dates, counts); "class" or "student" returns (dates, {class_id/student_id: counts})
+    days = (to_date - from_date).days + 1
+    dates = [from_date + datetime.timedelta(days=i) for i in range(max(days, 0))]
+    position = {str(date): i for i, date in enumerate(dates)}
+
+    params = [str(from_date), str(to_date)]
+    if student_id is None and group_by != "student":
+        # Overall and per-class numbers come from the daily_summary rollup (class_id 0 there means none)
+        key = "NULL" if group_by is None else "NULLIF(class_id, 0)"
+        query = f"SELECT date, {key}, SUM(present) FROM daily_summary WHERE date BETWEEN ? AND ?"
+        if class_id is not None:
+            query += " AND class_id = ?"
+            params.append(class_id)
+        query += " GROUP BY date" if group_by is None else " GROUP BY date, class_id"
+    else:
+        # Per-student series still read attendance; COUNT(*) is per student since (student_id, date) is unique
+        key = {None: "NULL", "class": "s.class_id"}.get(group_by, "a.student_id")
+        join = "CROSS JOIN students s ON a.student_id = s.id" if class_id is not None or group_by == "class" else ""
+        query = f"""
+            SELECT a.date, {key}, COUNT(*)
+            FROM attendance a
+            {join}
+            WHERE a.date BETWEEN ? AND ? AND a.status = 'P'
+        """
+        if class_id is not None:
+            query += " AND s.class_id = ?"
+            params.append(class_id)
+        if student_id is not None:
+            query += " AND a.student_id = ?"
+            params.append(student_id)
+        # Grouping on date alone follows the date index; adding a constant key would force a temp b-tree
+        query += " GROUP BY a.date" if group_by is None else f" GROUP BY a.date, {key}"
+
     conn = get_db_connection()
-    cur = conn.cursor()
-    dates = []
-    counts = []
-    for i in range(ndays):
-        date = datetime.date.today() - datetime.timedelta(days=ndays - 1 - i)
-        dates.append(date.strftime("%m/%d"))
-        cur.execute(
-            "SELECT COUNT(DISTINCT student_id) FROM attendance WHERE date = ? AND status = 'P'",
-            (str(date),),
-        )
-        counts.append(cur.fetchone()[0])
-    conn.close()
-    return dates, counts
+    series = {}
+    for date, group, count in conn.execute(query, params):
+        counts = series.setdefault(group, [0] * len(dates))
+        counts[position[date]] = count
+    if group_by is None:
+        return dates, series.get(None, [0] * len(dates))
+    return dates, series
+
 
+@timed
+def get_attendance_last_n_days(ndays=7, class_id=None):
+    today = datetime.date.today()
+    dates, counts = get_attendance_range(today - datetime.timedelta(days=ndays - 1), today, class_id=class_id)
+    return [date.strftime("%m/%d") for date in dates], counts
 
+
+@timed
 def get_attendance_trend_by_name(name, ndays=7):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -263,28 +652,15 @@ def get_attendance_trend_by_name(name, ndays=7):
     cur.execute("SELECT id FROM students WHERE name LIKE ?", (f"%{name}%",))
     row = cur.fetchone()
     if not row:
-        conn.close()
         return [], []
     student_id = row[0]
 
-    dates = []
-    counts = []
-    for i in range(ndays):
-        date = datetime.date.today() - datetime.timedelta(days=ndays - 1 - i)
-        dates.append(date.strftime("%m/%d"))
-        cur.execute(
-            """
-            SELECT COUNT(*)
-            FROM attendance
-            WHERE student_id = ? AND date = ? AND status = 'P'
-            """,
-            (student_id, str(date)),
-        )
-        counts.append(cur.fetchone()[0])
-    conn.close()
-    return dates, counts
+    today = datetime.date.today()
+    dates, counts = get_attendance_range(today - datetime.timedelta(days=ndays - 1), today, student_id=student_id)
+    return [date.strftime("%m/%d") for date in dates], counts
 
 
+@timed
 def get_recent_attendance(limit=5):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -299,46 +675,79 @@ def get_recent_attendance(limit=5):
         (limit,),
     )
     records = cur.fetchall()
-    conn.close()
     return records
 
 
-def get_attendance_reports(from_date, to_date, name_filter=None):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    query = """
-        SELECT
+def _attendance_report_query(from_date, to_date, name_filter=None, columns=None):
+    # Without a name filter the date range drives the query (CROSS JOIN pins attendance as the outer loop
+    # on the date index); with one, the planner starts from the few matching students instead
+    join = "JOIN" if name_filter else "CROSS JOIN"
+    columns = columns or """
             s.name,
             s.grno,
             s.rollno,
             s.std || '-' || s.section,
             a.date,
             a.time,
-            a.status
+            a.status"""
+    query = f"""
+        SELECT {columns}
         FROM attendance a
-        JOIN students s ON a.student_id = s.id
+        {join} students s ON a.student_id = s.id
         WHERE a.date BETWEEN ? AND ?
     """
     params = [from_date, to_date]
     if name_filter:
         query += " AND s.name LIKE ?"
         params.append(f"%{name_filter}%")
+    return query, params
+
+
+@timed
+def get_attendance_reports(from_date, to_date, name_filter=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    query, params = _attendance_report_query(from_date, to_date, name_filter)
     query += " ORDER BY a.date DESC, a.time DESC"
     cur.execute(query, params)
     records = cur.fetchall()
-    conn.close()
     return records
 
 
+@timed
+def count_attendance_reports(from_date, to_date, name_filter=None):
+    conn = get_db_connection()
+    query, params = _attendance_report_query(from_date, to_date, name_filter, columns="COUNT(*)")
+    return conn.execute(query, params).fetchone()[0]
+
+
+def iter_attendance_reports(from_date, to_date, name_filter=None, chunk_size=1000):
+    # Same rows and order as get_attendance_reports, yielded in lists of chunk_size via fetchmany,
+    # so an export of any range holds one chunk in memory
+    conn = get_db_connection()
+    query, params = _attendance_report_query(from_date, to_date, name_filter)
+    query += " ORDER BY a.date DESC, a.time DESC"
+    cur = conn.execute(query, params)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+
+@timed
 def get_all_classes():
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT id, name FROM classes")
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 
+@timed
 def get_classes_detailed():
     conn = get_db_connection()
     cur = conn.cursor()
@@ -346,75 +755,176 @@ def get_classes_detailed():
         "SELECT id, name, description, created_at FROM classes ORDER BY name"
     )
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 
+@timed
 def add_class(name, description):
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO classes (name, description, created_at) VALUES (?, ?, ?)",
-        (name, description, str(datetime.datetime.now())),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            "INSERT INTO classes (name, description, created_at) VALUES (?, ?, ?)",
+            (name, description, str(datetime.datetime.now())),
+        )
 
 
+@timed
 def delete_class(class_id):
+    conn = get_db_connection()
+    with conn:
+        conn.execute("DELETE FROM classes WHERE id = ?", (class_id,))
+
+
+@timed
+def get_student_classes():
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("DELETE FROM classes WHERE id = ?", (class_id,))
-    conn.commit()
-    conn.close()
+    cur.execute("SELECT id, class_id FROM students")
+    roster = {student_id: class_id for student_id, class_id in cur.fetchall()}
+    return roster
 
 
+@timed
+def get_student_identity_map():
+    # Loaded once per recognition session so marking never searches students by name
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, grno, rollno, class_id FROM students")
+    identities = {
+        student_id: {"name": name, "grno": grno, "rollno": rollno, "class_id": class_id}
+        for student_id, name, grno, rollno, class_id in cur.fetchall()
+    }
+    return identities
+
+
+@timed
 def get_class_student_count(class_id):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM students WHERE class_id = ?", (class_id,))
     count = cur.fetchone()[0]
-    conn.close()
     return count
 
 
+@timed
 def get_class_id_by_name(class_name):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT id FROM classes WHERE name = ?", (class_name,))
     row = cur.fetchone()
-    conn.close()
     return row[0] if row else None
 
 
-def bulk_import_students(students_data):
+IMPORT_COLUMNS = ["grno", "rollno", "name", "std", "section", "gender", "phoneno"]
+
+
+def _student_row(row, now):
+    # Validates one CSV row; returns the insert tuple or raises ValueError with the reason
+    values = {}
+    for column in IMPORT_COLUMNS:
+        value = (row.get(column) or "").strip()
+        if not value and column in ("grno", "name"):
+            raise ValueError(f"missing {column}")
+        values[column] = value
+    for column in ("grno", "rollno", "std"):
+        if values[column] or column == "grno":
+            try:
+                values[column] = int(values[column])
+            except ValueError:
+                raise ValueError(f"invalid {column} '{values[column]}'")
+        else:
+            values[column] = None
+    return (
+        values["grno"], values["rollno"], values["name"], values["std"],
+        values["section"], values["gender"], values["phoneno"], now,
+    )
+
+
+def _write_student_chunk(conn, rows, update_existing, report):
+    # One transaction per chunk: an interrupted import keeps whole chunks and never holds the write lock for long
+    grnos = list({row[0] for row in rows})
+    placeholders = ",".join("?" * len(grnos))
+    with conn:
+        existing = {r[0] for r in conn.execute(f"SELECT grno FROM students WHERE grno IN ({placeholders})", grnos)}
+        on_conflict = (
+            """DO UPDATE SET rollno = excluded.rollno, name = excluded.name, std = excluded.std,
+               section = excluded.section, gender = excluded.gender, phoneno = excluded.phoneno"""
+            if update_existing else "DO NOTHING"
+        )
+        conn.executemany(
+            f"""
+            INSERT INTO students (grno, rollno, name, std, section, gender, phoneno, class_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+            ON CONFLICT (grno) {on_conflict}
+            """,
+            rows,
+        )
+    for grno in (row[0] for row in rows):
+        if grno not in existing:
+            report["inserted"] += 1
+            existing.add(grno) # a repeated grno later in the file is an update
+        elif update_existing:
+            report["updated"] += 1
+        else:
+            report["skipped"] += 1
+
+
+def _fallback_encoding():
+    # The locale's encoding, or Windows-1252 (Excel's "CSV" on Windows) when the locale is UTF-8 anyway
+    encoding = locale.getpreferredencoding(False)
+    return "cp1252" if codecs.lookup(encoding).name == "utf-8" else encoding
+
+
+@timed
+def import_students_csv(path, update_existing=True, chunk_size=500, progress=None):
+    # Streams the CSV in chunks; rows with a known grno are updated (or skipped if update_existing is False).
+    # Each line is decoded as UTF-8, falling back to the locale/ANSI encoding; undecodable lines are rejected.
+    # Returns {"rows", "inserted", "updated", "skipped", "rejected": [(line, reason)]};
+    # progress(rows_done, fraction) is called after every chunk
+    report = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "rejected": []}
+    total_size = os.path.getsize(path) or 1
+    consumed = 0
+    line_no = 0 # physical line of the last line handed to the csv reader
+    fallback = _fallback_encoding()
     conn = get_db_connection()
-    cur = conn.cursor()
-    count = 0
-    for row in students_data:
-        try:
-            cur.execute(
-                """
-                INSERT INTO students (
-                    grno, rollno, name, std, section, gender, phoneno,
-                    class_id, created_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
-                """,
-                (
-                    int(row["grno"]),
-                    int(row["rollno"]),
-                    row["name"],
-                    int(row["std"]),
-                    row["section"],
-                    row["gender"],
-                    row["phoneno"],
-                    str(datetime.datetime.now()),
-                ),
-            )
-            count += 1
-        except Exception:
-            continue
-    conn.commit()
-    conn.close()
-    return count
\ No newline at end of file
+    now = str(datetime.datetime.now())
+
+    with open(path, "rb") as f:
+        def lines():
+            nonlocal consumed, line_no
+            for number, raw in enumerate(f, 1):
+                consumed += len(raw)
+                try:
+                    line = raw.decode("utf-8-sig" if number == 1 else "utf-8")
+                except UnicodeDecodeError:
+                    try:
+                        line = raw.decode(fallback)
+                    except UnicodeDecodeError as e:
+                        report["rejected"].append((number, f"undecodable text ({e.reason})"))
+                        continue
+                line_no = number
+                yield line
+
+        reader = csv.DictReader(lines())
+        missing = [c for c in IMPORT_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+
+        chunk = []
+        for row in reader:
+            report["rows"] += 1
+            try:
+                chunk.append(_student_row(row, now))
+            except ValueError as e:
+                report["rejected"].append((line_no, str(e)))
+            if len(chunk) >= chunk_size:
+                _write_student_chunk(conn, chunk, update_existing, report)
+                chunk = []
+                if progress is not None:
+                    progress(report["rows"], min(consumed / total_size, 1.0))
+        if chunk:
+            _write_student_chunk(conn, chunk, update_existing, report)
+    if progress is not None:
+        progress(report["rows"], 1.0)
+    report["rejected"].sort()
+    return report
@@ -3,9 +3,10 @@ import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import messagebox, filedialog
 import datetime
-import csv
+import threading
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.ticker import MaxNLocator
 
 # Set appearance
 ctk.set_appearance_mode("dark")
@@ -40,6 +41,9 @@ THEME = {
 APP_NAME = "AttendancePro"
 VERSION = "2.0"
 
+# Dashboard trend windows (label -> days)
+DASHBOARD_WINDOWS = {"Last 7 Days": 7, "Last 30 Days": 30, "Last 90 Days": 90, "Last 365 Days": 365}
+
 class Toast:
     def __init__(self, parent, message, type="info", duration=3000):
         self.toast = ctk.CTkFrame(
@@ -69,6 +73,41 @@ class Toast:
     def destroy(self):
         self.toast.destroy()
 
+class ProgressDialog:
+    # Small modal window for long jobs running on a worker thread; the Tk thread feeds it via update()
+    def __init__(self, parent, title, on_cancel=None):
+        self.window = ctk.CTkToplevel(parent)
+        self.window.title(title)
+        self.window.geometry("420x170")
+        self.window.resizable(False, False)
+        self.window.configure(fg_color=THEME["bg_secondary"])
+        self.window.transient(parent)
+        self.window.protocol("WM_DELETE_WINDOW", on_cancel or (lambda: None))
+        
+        self.label = ctk.CTkLabel(self.window, text="Starting...", font=("Segoe UI", 14), text_color=THEME["text_primary"])
+        self.label.pack(pady=(25, 10))
+        
+        self.bar = ctk.CTkProgressBar(self.window, width=360, progress_color=THEME["accent_purple"])
+        self.bar.set(0)
+        self.bar.pack(pady=5)
+        
+        if on_cancel is not None:
+            ModernButton(
+                self.window,
+                text="Cancel",
+                width=120,
+                height=36,
+                fg_color=THEME["danger"],
+                command=on_cancel,
+            ).pack(pady=15)
+    
+    def update(self, fraction, text):
+        self.bar.set(fraction)
+        self.label.configure(text=text)
+    
+    def close(self):
+        self.window.destroy()
+
 class ModernButton(ctk.CTkButton):
     def __init__(self, master, **kwargs):
         defaults = {
@@ -264,18 +303,31 @@ class AttendanceProApp(ctk.CTk):
             height=40,
         ).pack(side="left")
         
+        # Chart window and grouping; each redraw is a single range query
+        self.dashboard_window_var = ctk.StringVar(value="Last 7 Days")
+        self.dashboard_group_var = ctk.StringVar(value="Overall")
+        for var, values in (
+            (self.dashboard_window_var, list(DASHBOARD_WINDOWS)),
+            (self.dashboard_group_var, ["Overall", "By Class"]),
+        ):
+            ctk.CTkComboBox(
+                filter_frame,
+                values=values,
+                variable=var,
+                width=140,
+                state="readonly",
+                fg_color=THEME["card_bg"],
+                button_color=THEME["accent_purple"],
+                button_hover_color=THEME["accent_blue"],
+                command=lambda _: self.load_dashboard_trend_chart(),
+            ).pack(side="left", padx=(10, 0))
+        
         # Container for the chart (will be redrawn on filter)
         self.dashboard_trend_container = ctk.CTkFrame(charts_frame, fg_color="transparent")
         self.dashboard_trend_container.pack(fill="both", expand=True, pady=(0, 10))
         
         # Initial chart load
-        dates, counts = self.db.get_attendance_last_n_days(7)
-        self.create_attendance_chart(
-            self.dashboard_trend_container,
-            title="Attendance Trends - Overall (Last 7 Days)",
-            dates=dates,
-            counts=counts
-        )
+        self.load_dashboard_trend_chart()
         
         # Recent activity
         self.create_recent_activity(charts_frame)
@@ -286,27 +338,45 @@ class AttendanceProApp(ctk.CTk):
             widget.destroy()
         
         name = self.dashboard_trend_name.get().strip()
+        window = self.dashboard_window_var.get()
+        ndays = DASHBOARD_WINDOWS[window]
+        series = None
         
         if name:
-            dates, counts = self.db.get_attendance_trend_by_name(name, 7)
+            dates, counts = self.db.get_attendance_trend_by_name(name, ndays)
             if not dates or sum(counts) == 0:
                 Toast(self, f"No attendance data found for '{name}'", "info")
-                dates, counts = self.db.get_attendance_last_n_days(7)
-                title = "Attendance Trends - Overall (Last 7 Days)"
+                dates, counts = self.db.get_attendance_last_n_days(ndays)
+                title = f"Attendance Trends - Overall ({window})"
             else:
-                title = f"Attendance Trends - {name} (Last 7 Days)"
+                title = f"Attendance Trends - {name} ({window})"
+        elif self.dashboard_group_var.get() == "By Class":
+            today = datetime.date.today()
+            days, by_class = self.db.get_attendance_range(
+                today - datetime.timedelta(days=ndays - 1), today, group_by="class"
+            )
+            class_names = dict(self.db.get_all_classes())
+            dates = [day.strftime("%m/%d") for day in days]
+            counts = None
+            # "No Class" only for students without one; a deleted class keeps its own line
+            series = {
+                "No Class" if cid is None else class_names.get(cid, f"Class {cid}"): values
+                for cid, values in by_class.items()
+            }
+            title = f"Attendance Trends - By Class ({window})"
         else:
-            dates, counts = self.db.get_attendance_last_n_days(7)
-            title = "Attendance Trends - Overall (Last 7 Days)"
+            dates, counts = self.db.get_attendance_last_n_days(ndays)
+            title = f"Attendance Trends - Overall ({window})"
         
         self.create_attendance_chart(
             self.dashboard_trend_container,
             title=title,
             dates=dates,
-            counts=counts
+            counts=counts,
+            series=series,
         )
     
-    def create_attendance_chart(self, parent, title="Attendance Trends (Last 7 Days)", dates=None, counts=None):
+    def create_attendance_chart(self, parent, title="Attendance Trends (Last 7 Days)", dates=None, counts=None, series=None):
         chart_card = ModernCard(parent)
         chart_card.pack(fill="both", expand=True, pady=(0, 10))
         
@@ -318,14 +388,21 @@ class AttendanceProApp(ctk.CTk):
         ).pack(pady=15, padx=20, anchor="w")
         
         # Get data if not provided
-        if dates is None or counts is None:
+        if dates is None or (counts is None and series is None):
             dates, counts = self.db.get_attendance_last_n_days(7)
         
         # Create chart
         fig, ax = plt.subplots(figsize=(10, 4), facecolor=THEME["card_bg"])
         ax.set_facecolor(THEME["card_bg"])
-        ax.plot(dates, counts, color=THEME["accent_purple"], linewidth=3, marker='o', markersize=8)
-        ax.fill_between(dates, counts, alpha=0.3, color=THEME["accent_purple"])
+        marker = 'o' if len(dates) <= 31 else None # markers turn into a smear on long windows
+        if series:
+            for label, values in series.items():
+                ax.plot(dates, values, linewidth=2, marker=marker, markersize=5, label=label)
+            ax.legend(fontsize=9, ncol=2, frameon=False, labelcolor=THEME["text_secondary"])
+        else:
+            ax.plot(dates, counts, color=THEME["accent_purple"], linewidth=3, marker=marker, markersize=8)
+            ax.fill_between(dates, counts, alpha=0.3, color=THEME["accent_purple"])
+        ax.xaxis.set_major_locator(MaxNLocator(12)) # at most ~12 date labels, whatever the window
         ax.set_xlabel("Date", color=THEME["text_secondary"], fontsize=12)
         ax.set_ylabel("Students Present", color=THEME["text_secondary"], fontsize=12)
         ax.tick_params(colors=THEME["text_secondary"])
@@ -693,11 +770,11 @@ class AttendanceProApp(ctk.CTk):
                     classid = 1  # Default class fallback
                 
                 # Add student to database
-                self.db.add_student(grno, rollno, name, std, section, gender, phoneno, classid)
+                student_id = self.db.add_student(grno, rollno, name, std, section, gender, phoneno, classid)
                 
                 # Record face
                 Toast(self, f"Recording face for {name}. Look at the camera!", "info")
-                success = self.backend.record_face(name)
+                success = self.backend.record_face(student_id, name, config=self.config)
                 
                 if success:
                     Toast(self, f"✓ Student {name} added successfully!", "success")
@@ -864,7 +941,7 @@ class AttendanceProApp(ctk.CTk):
         if result:
             try:
                 self.db.delete_student(student_id)
-                self.backend.delete_face_data(name)
+                self.backend.delete_face_data(student_id, name)
                 Toast(self, f"Student {name} deleted successfully!", "success")
                 self.load_students()
             except Exception as e:
@@ -879,16 +956,61 @@ class AttendanceProApp(ctk.CTk):
         if not filepath:
             return
         
-        try:
-            with open(filepath, 'r') as f:
-                reader = csv.DictReader(f)
-                students_data = list(reader)
-            
-            count = self.db.bulk_import_students(students_data)
-            Toast(self, f"Successfully imported {count} students!", "success")
+        dialog = ProgressDialog(self, "Importing Students")
+        
+        def work(progress, cancelled):
+            return self.db.import_students_csv(filepath, progress=lambda rows, fraction: progress(fraction, f"{rows} rows read"))
+        
+        def done(report, error):
+            dialog.close()
+            if error is not None:
+                Toast(self, f"Import error: {str(error)}", "error")
+                return
+            rejected = report["rejected"]
+            message = f"Imported {report['inserted']} new, updated {report['updated']} students"
+            if rejected:
+                for line, reason in rejected:
+                    print(f"Import: line {line} rejected: {reason}")
+                details = "\n".join(f"Line {line}: {reason}" for line, reason in rejected[:15])
+                if len(rejected) > 15:
+                    details += f"\n... and {len(rejected) - 15} more (see console)"
+                messagebox.showwarning("Import Report", f"{message}.\n\n{len(rejected)} rows rejected:\n{details}")
+            else:
+                Toast(self, f"{message}!", "success")
             self.load_students()
-        except Exception as e:
-            Toast(self, f"Import error: {str(e)}", "error")
+        
+        self.run_in_background(work, done, dialog)
+    
+    def run_in_background(self, work, done, dialog=None, cancelled=None):
+        # work(progress, cancelled) runs on a worker thread; progress(fraction, text) is only stored there and
+        # picked up by the Tk thread every 100 ms. done(result, error) runs on the Tk thread.
+        state = {"progress": None, "result": None, "error": None}
+        cancelled = cancelled or threading.Event()
+        
+        def progress(fraction, text):
+            state["progress"] = (fraction, text)
+        
+        def run():
+            try:
+                state["result"] = work(progress, cancelled)
+            except Exception as e:
+                state["error"] = e
+            finally:
+                self.db.close_db_connection() # each worker thread has its own connection
+        
+        worker = threading.Thread(target=run, daemon=True)
+        
+        def poll():
+            if dialog is not None and state["progress"] is not None:
+                dialog.update(*state["progress"])
+            if worker.is_alive():
+                self.after(100, poll)
+            else:
+                done(state["result"], state["error"])
+        
+        worker.start()
+        self.after(100, poll)
+        return cancelled
     
     def show_attendance(self):
         self.clear_content()
@@ -944,6 +1066,22 @@ class AttendanceProApp(ctk.CTk):
             text_color=THEME["text_secondary"],
         ).pack(pady=10)
         
+        # Class selection: a session only searches the chosen class's faces
+        classes = self.db.get_all_classes()
+        self.attendance_classes = {name: cid for cid, name in classes}
+        self.attendance_class_var = ctk.StringVar(value="All Classes")
+        
+        ctk.CTkComboBox(
+            action_card,
+            values=["All Classes"] + [name for _, name in classes],
+            variable=self.attendance_class_var,
+            width=280,
+            state="readonly",
+            fg_color=THEME["card_bg"],
+            button_color=THEME["accent_purple"],
+            button_hover_color=THEME["accent_blue"],
+        ).pack(pady=(10, 0))
+        
         ModernButton(
             action_card,
             text="🎥 Start Recognition",
@@ -962,11 +1100,18 @@ class AttendanceProApp(ctk.CTk):
             text_color=THEME["text_primary"],
         ).pack(pady=(20, 5))
         
-        instructions = [
-            "• Position your face in front of the camera",
-            "• Press 'M' to mark attendance when face is recognized",
-            "• Press 'Q' to quit recognition mode",
-        ]
+        if self.config.get("auto_mark"):
+            instructions = [
+                "• Position your face in front of the camera",
+                "• Auto-mark is on: attendance is marked once your name turns green",
+                "• Press 'Q' to quit recognition mode",
+            ]
+        else:
+            instructions = [
+                "• Position your face in front of the camera",
+                "• Press 'N' to mark attendance when face is recognized",
+                "• Press 'Q' to quit recognition mode",
+            ]
         
         for inst in instructions:
             ctk.CTkLabel(
@@ -977,9 +1122,13 @@ class AttendanceProApp(ctk.CTk):
             ).pack(pady=2)
     
     def start_face_recognition(self):
-        marked = self.backend.recognize_and_mark_attendance(self.db)
+        class_id = self.attendance_classes.get(self.attendance_class_var.get())
+        marked = self.backend.recognize_and_mark_attendance(self.db, self.config, class_id=class_id)
         if marked is None:
-            Toast(self, "No face data found! Please add students first.", "warning")
+            if class_id is not None:
+                Toast(self, "No face data found for this class!", "warning")
+            else:
+                Toast(self, "No face data found! Please add students first.", "warning")
         else:
             # Speak a message when attendance flow ends
             if marked:  # at least one student marked
@@ -1252,14 +1401,10 @@ class AttendanceProApp(ctk.CTk):
     def export_reports(self):
         from_date = self.report_from_date.get().strip()
         to_date = self.report_to_date.get().strip()
-        name = self.report_name.get().strip()
+        name = self.report_name.get().strip() or None
         
-        records = self.db.get_attendance_reports(
-            from_date, to_date, 
-            f"%{name}%" if name else None
-        )
-        
-        if not records:
+        total = self.db.count_attendance_reports(from_date, to_date, name)
+        if not total:
             Toast(self, "No data to export", "warning")
             return
         
@@ -1269,16 +1414,33 @@ class AttendanceProApp(ctk.CTk):
             initialfile=f"attendance_{datetime.date.today()}.csv"
         )
         
-        if filename:
-            success = self.backend.export_to_csv(
-                records,
+        if not filename:
+            return
+        
+        # Rows are streamed from the cursor to the file on a worker thread, a chunk at a time
+        cancelled = threading.Event()
+        dialog = ProgressDialog(self, "Exporting Report", on_cancel=cancelled.set)
+        
+        def work(progress, cancelled):
+            return self.backend.export_chunks_to_csv(
+                self.db.iter_attendance_reports(from_date, to_date, name),
                 ["Name", "GR No", "Roll No", "Class", "Date", "Time", "Status"], # column headers
-                filename
+                filename,
+                total=total,
+                progress=lambda written, total: progress(written / total, f"{written} of {total} rows written"),
+                cancelled=cancelled,
             )
-            if success:
-                Toast(self, "Report exported successfully!", "success")
-            else:
+        
+        def done(written, error):
+            dialog.close()
+            if written is None and cancelled.is_set():
+                Toast(self, "Export cancelled", "info")
+            elif written is None or error is not None:
                 Toast(self, "Export failed", "error")
+            else:
+                Toast(self, f"Report exported successfully! ({written} rows)", "success")
+        
+        self.run_in_background(work, done, dialog, cancelled)
 
     
     def show_classes(self):
@@ -1530,12 +1692,15 @@ class AttendanceProApp(ctk.CTk):
         settings_card = ModernCard(self.content_area)
         settings_card.pack(fill="both", expand=True, padx=30, pady=(0, 30))
         
+        settings_body = ctk.CTkScrollableFrame(settings_card, fg_color="transparent")
+        settings_body.pack(fill="both", expand=True, padx=10, pady=10)
+        
         # --- BUG FIX 2: Retrieve DB_PATH directly from the imported db module ---
         # We try to get it from self.db.DB_PATH, fallback to config if missing
         actual_db_path = getattr(self.db, 'DB_PATH', self.config.get("db_path", "N/A"))
         
         self.create_setting_item(
-            settings_card,
+            settings_body,
             "📁 Database Path",
             actual_db_path,
             "Location of the attendance database file"
@@ -1544,7 +1709,7 @@ class AttendanceProApp(ctk.CTk):
         
         # Face dataset path
         self.create_setting_item(
-            settings_card,
+            settings_body,
             "👤 Face Dataset Path",
             self.config.get("dataset_dir", "N/A"),
             "Location where face recognition data is stored"
@@ -1552,22 +1717,65 @@ class AttendanceProApp(ctk.CTk):
         
         # Camera index
         self.create_setting_item(
-            settings_card,
+            settings_body,
             "🎥 Camera Index",
-            str(self.config.get("camera_index", 0)),
-            "Camera device index (usually 0 for default camera)"
+            self.config.get("video_source") or str(self.config.get("camera_index", 0)),
+            "Camera device index (usually 0 for default camera), or a video file / image folder set as video_source"
         )
         
         # Recognition threshold
         self.create_setting_item(
-            settings_card,
+            settings_body,
             "🎯 Recognition Threshold",
             str(self.config.get("recognition_threshold", 0.6)),
             "Confidence threshold for face recognition (0.0 - 1.0)"
         )
         
+        # Auto mark
+        self.create_setting_item(
+            settings_body,
+            "🤖 Auto Mark",
+            f"On (stable for {self.config.get('auto_mark_stable_frames', 3)} recognitions)" if self.config.get("auto_mark") else "Off",
+            "Marks a student hands-free once the KNN vote ratio stays above the recognition threshold"
+        )
+        
+        # PCA projection
+        self.create_setting_item(
+            settings_body,
+            "🧮 PCA Projection",
+            f"{self.config.get('pca_components', 200)} components" if self.config.get("use_pca") else "Disabled",
+            "Projects faces onto an eigenface basis before matching (use_pca / pca_components)"
+        )
+        
+        # Search mode
+        self.create_setting_item(
+            settings_body,
+            "🔎 Search Mode",
+            f"Coarse-to-fine ({self.config.get('coarse_candidates', 200)} candidates)" if self.config.get("search_mode") == "coarse" else "Full KNN",
+            "Coarse mode shortlists faces on 20x20 thumbnails and re-ranks only those at full resolution"
+        )
+        
+        # Gallery condensation
+        self.create_setting_item(
+            settings_body,
+            "🗜 Prototypes per Student",
+            str(self.config.get("prototypes_per_student", 0) or "All samples"),
+            "Enrollment keeps this many k-means prototypes per student (python maintenance.py condense)"
+        )
+        
+        # Detection scale
+        self.create_setting_item(
+            settings_body,
+            "🔍 Detection Scale",
+            f"{self.config.get('detection_scale', 1.0)}x (face size {self.config.get('min_face_size', 0)} - {self.config.get('max_face_size', 0) or 'any'} px)",
+            "Face detection runs on a downscaled frame; boxes are mapped back for the full-resolution crop"
+        )
+        
+        # Performance
+        self.create_performance_section(settings_body)
+        
         # App info
-        info_frame = ctk.CTkFrame(settings_card, fg_color=THEME["bg_tertiary"], corner_radius=10)
+        info_frame = ctk.CTkFrame(settings_body, fg_color=THEME["bg_tertiary"], corner_radius=10)
         info_frame.pack(fill="x", padx=20, pady=20)
         
         ctk.CTkLabel(
@@ -1591,6 +1799,79 @@ class AttendanceProApp(ctk.CTk):
             text_color=THEME["text_tertiary"]
         ).pack(pady=(0, 10))
 
+    def create_performance_section(self, parent):
+        perf_frame = ctk.CTkFrame(parent, fg_color=THEME["bg_tertiary"], corner_radius=10)
+        perf_frame.pack(fill="x", padx=20, pady=(20, 0))
+        
+        header = ctk.CTkFrame(perf_frame, fg_color="transparent")
+        header.pack(fill="x", padx=15, pady=(10, 5))
+        
+        ctk.CTkLabel(
+            header,
+            text="📈 Performance (last recognition session)",
+            font=("Segoe UI", 15, "bold"),
+            text_color=THEME["text_primary"]
+        ).pack(side="left")
+        
+        ModernButton(
+            header,
+            text="💾 Export",
+            fg_color=THEME["accent_purple"],
+            hover_color=THEME["accent_blue"],
+            command=self.export_performance,
+            width=100,
+            height=32,
+        ).pack(side="right")
+        
+        summary = self.backend.perf.summary()
+        if not summary["stages"]:
+            ctk.CTkLabel(
+                perf_frame,
+                text="No timings yet - run a recognition session first",
+                font=("Segoe UI", 12),
+                text_color=THEME["text_tertiary"]
+            ).pack(anchor="w", padx=15, pady=(0, 10))
+            return
+        
+        fps_text = "   ".join(f"{name}: {value:.1f} FPS" for name, value in summary["fps"].items())
+        ctk.CTkLabel(
+            perf_frame,
+            text=fps_text,
+            font=("Segoe UI", 12, "bold"),
+            text_color=THEME["accent_blue"]
+        ).pack(anchor="w", padx=15, pady=(0, 5))
+        
+        table = ctk.CTkFrame(perf_frame, fg_color="transparent")
+        table.pack(fill="x", padx=15, pady=(0, 10))
+        
+        rows = [("Stage", "p50 ms", "p95 ms", "p99 ms", "Samples")]
+        for stage, st in summary["stages"].items():
+            rows.append((stage, f"{st['p50']:.2f}", f"{st['p95']:.2f}", f"{st['p99']:.2f}", str(st["count"])))
+        
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                ctk.CTkLabel(
+                    table,
+                    text=value,
+                    font=("Consolas", 12, "bold" if r == 0 else "normal"),
+                    text_color=THEME["text_secondary"] if r == 0 else THEME["text_primary"],
+                    anchor="w" if c == 0 else "e",
+                    width=220 if c == 0 else 90,
+                ).grid(row=r, column=c, sticky="ew", padx=5)
+    
+    def export_performance(self):
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json")],
+            initialfile=f"performance_{datetime.date.today()}.json"
+        )
+        
+        if filename:
+            if self.backend.perf.export(filename):
+                Toast(self, "Performance data exported!", "success")
+            else:
+                Toast(self, "Export failed", "error")
+
     def create_setting_item(self, parent, title, value, description):
         item_frame = ctk.CTkFrame(parent, fg_color="transparent")
         item_frame.pack(fill="x", padx=20, pady=15)
@@ -5,6 +5,8 @@ import frontend
 if __name__ == "__main__":
 
     db_logic.init_db()
+    db_logic.set_timing_hook(backend.perf.record)
     config = backend.load_config()
+    backend.migrate_face_files(db_logic)
     app = frontend.AttendanceProApp(db_logic, backend, config)
     app.mainloop()
\ No newline at end of file
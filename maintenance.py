@@ -0,0 +1,71 @@
+import argparse
+import json
+import sys
+
+import backend
+import db_logic
+
+
+def cmd_condense(args):
+    config = backend.load_config()
+    n = args.prototypes if args.prototypes is not None else int(config.get("prototypes_per_student", 0))
+    report = backend.condense_dataset(n, evaluate=args.evaluate)
+    print(json.dumps(report, indent=4))
+    return 0
+
+
+def cmd_rebuild_gallery(args):
+    if not backend.build_gallery():
+        print("No face data found")
+        return 1
+    gallery = backend.load_gallery()
+    report = gallery.memory_report()
+    config = backend.load_config()
+    if config.get("search_mode") == "coarse":
+        # Done here so the first recognition session does not pay for the full-gallery check
+        report["coarse_agreement"] = backend.coarse_agreement(gallery, candidates=int(config.get("coarse_candidates", 200)))
+    print(json.dumps(report, indent=4))
+    return 0
+
+
+def cmd_refit_pca(args):
+    config = backend.load_config()
+    projector = backend.refit_projection(int(config.get("pca_components", 200)))
+    if projector is None:
+        print("No face data found")
+        return 1
+    print(f"PCA basis refitted on {projector.n_samples_seen} samples, {projector.components.shape[0]} components")
+    return 0
+
+
+def cmd_rebuild_summary(args):
+    db_logic.init_db()
+    rows = db_logic.rebuild_daily_summary()
+    print(f"daily_summary rebuilt: {rows} (date, class) rows")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AttendancePro maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    p = sub.add_parser("condense", help="reduce every student to k-means prototypes (0 restores all samples)")
+    p.add_argument("--prototypes", type=int, help="prototypes per student, defaults to the config value")
+    p.add_argument("--evaluate", action="store_true", help="report size, latency and held-out accuracy first")
+    p.set_defaults(func=cmd_condense)
+    
+    p = sub.add_parser("rebuild-gallery", help="rebuild the consolidated face gallery cache")
+    p.set_defaults(func=cmd_rebuild_gallery)
+    
+    p = sub.add_parser("refit-pca", help="refit the PCA basis on the whole gallery")
+    p.set_defaults(func=cmd_refit_pca)
+    
+    p = sub.add_parser("rebuild-summary", help="recompute the daily attendance summary from raw attendance")
+    p.set_defaults(func=cmd_rebuild_summary)
+    
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())